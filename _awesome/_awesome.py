@@ -7,20 +7,27 @@
 # http://support.microsoft.com/kb/216893#LetMeFixItMyselfAlways
 
 import aenea
-import aenea.misc
 import aenea.configuration
+import aenea.lax
 
-import dragonfly
+import aenea_grammars.actions
+import aenea_grammars.cache
+import aenea_grammars.context
+import aenea_grammars.instrument
+import aenea_grammars.lazy
+import aenea_grammars.reload
+import aenea_grammars.rules
 
-awesome_context = aenea.ProxyPlatformContext('linux')
+import dragonfly
 
-grammar = dragonfly.Grammar('awesome', context=awesome_context)
+awesome_context = aenea_grammars.context.ProxyPlatformContext('linux')
+aenea_grammars.context.subscribe()
 
 awesome = 'W'
 
-from aenea.lax import Key
+Key = aenea_grammars.actions.interned(aenea.lax.Key)
 
-basics_mapping = aenea.configuration.make_grammar_commands('awesome', {
+basics_commands = {
     'termie': Key(awesome + '-enter'),
     '(whim | notion | ion) screen': Key(awesome + 'c-k'),
     '(whim | notion | ion) up': Key(awesome + '-k'),
@@ -35,19 +42,31 @@ basics_mapping = aenea.configuration.make_grammar_commands('awesome', {
     '(whim | notion | ion) tag <n>': Key(awesome + 'sc-%(n)d'),
     '(whim | notion | ion) tag marked <n>': Key(awesome + 's-%(n)d'),
     '(whim | notion | ion) move marked <n>': Key(awesome + 's-%(n)d')
-    })
+    }
 
 
+@aenea_grammars.instrument.instrumented
 class Basics(dragonfly.MappingRule):
-    mapping = basics_mapping
-    extras = [aenea.misc.DigitalInteger('n', 1, None)]
+    pass
+
+
+def build_grammar(grammar):
+    build_cache = aenea_grammars.cache.BuildCache(
+        'awesome', __file__, configs=['awesome'])
+    grammar.add_rule(Basics(
+        mapping=build_cache.grammar_commands('awesome', basics_commands),
+        extras=[aenea_grammars.rules.digital_integer('n', 1, None)]))
 
-grammar.add_rule(Basics())
+grammar = aenea_grammars.lazy.LazyGrammar(
+    'awesome', awesome_context, build_grammar)
 grammar.load()
+reloader = aenea_grammars.reload.Reloader(['awesome'], grammar)
 
 
 def unload():
     global grammar
+    reloader.stop()
+    aenea_grammars.context.unsubscribe()
     if grammar:
         grammar.unload()
     grammar = None
@@ -1,58 +1,78 @@
 import aenea.config
 import aenea.configuration
 
+import aenea_grammars.cache
+import aenea_grammars.context
+import aenea_grammars.instrument
+import aenea_grammars.lazy
+import aenea_grammars.reload
+import aenea_grammars.rules
+
 from aenea import (
     AeneaContext,
     AppContext,
     Dictation,
-    Grammar,
-    IntegerRef,
+    MappingRule
+    )
+
+from aenea_grammars.actions import (
     Key,
-    MappingRule,
-    ProxyAppContext,
     Text
     )
 
 chromium_context = aenea.AeneaContext(
-    ProxyAppContext(cls_name='chromium', cls='chromium'),
+    aenea_grammars.context.ProxyAppContext(cls_name='chromium', cls='chromium'),
     (AppContext(executable='chrome') | AppContext(executable='chromium'))
     )
 
-chromium_grammar = Grammar('chromium', context=chromium_context)
+aenea_grammars.context.subscribe()
 
+chromium_commands = {
+    'close [<n>] ( frame | frames )':    Key('c-w:%(n)d'),
+    'open frame':                        Key('c-t'),
+    'open window':                       Key('c-n'),
+    'reopen [<n>] ( frame | frames )':   Key('cs-t:%(n)d'),
+    '[ go to ] frame [<n>]':             Key('c-%(n)d'),
+    'frame left [<n>]':                  Key('cs-tab:%(n)d'),
+    'frame right [<n>]':                 Key('c-tab:%(n)d'),
+    'search [<text>]':                   Key('c-k') + Text('%(text)s'),
+    'find [<text>]':                     Key('c-f') + Text('%(text)s'),
+    'history':                           Key('c-h'),
+    'reload':                            Key('c-r'),
+    'next [<n>]':                        Key('c-g:%(n)d'),
+    'previous [<n>]':                    Key('cs-g:%(n)d'),
+    'back [<n>]':                        Key('a-left:%(n)d'),
+    'forward [<n>]':                     Key('a-right:%(n)d'),
+    }
 
+
+@aenea_grammars.instrument.instrumented
 class ChromiumRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands('chromium', {
-        'close [<n>] ( frame | frames )':    Key('c-w:%(n)d'),
-        'open frame':                        Key('c-t'),
-        'open window':                       Key('c-n'),
-        'reopen [<n>] ( frame | frames )':   Key('cs-t:%(n)d'),
-        '[ go to ] frame [<n>]':             Key('c-%(n)d'),
-        'frame left [<n>]':                  Key('cs-tab:%(n)d'),
-        'frame right [<n>]':                 Key('c-tab:%(n)d'),
-        'search [<text>]':                   Key('c-k') + Text('%(text)s'),
-        'find [<text>]':                     Key('c-f') + Text('%(text)s'),
-        'history':                           Key('c-h'),
-        'reload':                            Key('c-r'),
-        'next [<n>]':                        Key('c-g:%(n)d'),
-        'previous [<n>]':                    Key('cs-g:%(n)d'),
-        'back [<n>]':                        Key('a-left:%(n)d'),
-        'forward [<n>]':                     Key('a-right:%(n)d'),
-        })
-
-    extras = [IntegerRef('n', 1, 10), Dictation('text')]
     defaults = {
         'n': 1,
         'text': ''
         }
 
-chromium_grammar.add_rule(ChromiumRule())
 
+def build_grammar(grammar):
+    build_cache = aenea_grammars.cache.BuildCache(
+        'chromium', __file__, configs=['chromium'])
+    grammar.add_rule(ChromiumRule(
+        mapping=build_cache.grammar_commands('chromium', chromium_commands),
+        extras=[aenea_grammars.rules.integer_ref('n', 1, 10),
+                Dictation('text')]))
+
+# Rules are only sent to the engine once chromium has had focus.
+chromium_grammar = aenea_grammars.lazy.LazyGrammar(
+    'chromium', chromium_context, build_grammar)
 chromium_grammar.load()
+reloader = aenea_grammars.reload.Reloader(['chromium'], chromium_grammar)
 
 
 def unload():
     global chromium_grammar
+    reloader.stop()
+    aenea_grammars.context.unsubscribe()
     if chromium_grammar:
         chromium_grammar.unload()
     chromium_grammar = None
@@ -1,8 +1,11 @@
-import aenea.config
-import aenea.configuration
+import aenea
+
+import aenea_grammars.cache
+import aenea_grammars.extract
+import aenea_grammars.instrument
+import aenea_grammars.reload
 
 from dragonfly import (
-    Grammar,
     MappingRule,
     RuleRef,
     Repetition,
@@ -10,20 +13,64 @@ from dragonfly import (
     CompoundRule,
 )
 
-from aenea import Text
+GIT_CONFIGS = [
+    'git_add_options',
+    'git_commit_options',
+    'git_checkout_options',
+    'git_push_options',
+    'git_status_options',
+    'git_branch_options',
+    'git_pull_options',
+]
 
 
 def recurse_values(node, types):
-    value = ''
-    for child in node.children:
+    # Values of every node below node whose actor is one of types, in
+    # document order, gathered in a single walk and joined once.
+    types = frozenset(types)
+    values = []
+    stack = node.children[::-1]
+    while stack:
+        child = stack.pop()
         if child.actor.__class__ in types:
-            value += child.value()
-        value += recurse_values(child, types)
-    return value
+            values.append(child.value())
+        stack.extend(child.children[::-1])
+    return ''.join(values)
+
+
+class GitOptionRule(MappingRule):
+    # The options of one subcommand, which may be rebound in
+    # grammar_config/<config>.json.
+    config = None
+    options = {}
+
+    def __init__(self, build_cache):
+        MappingRule.__init__(self, mapping=build_cache.grammar_commands(
+            self.config, self.options))
+
+
+@aenea_grammars.instrument.instrumented
+class GitSubcommandRule(CompoundRule):
+    # A git subcommand followed by the values of up to nine of its options.
+    subcommand = None
+    option_rule = None
 
+    def __init__(self, build_cache):
+        options = Repetition(
+            RuleRef(name='%s_option' % self.subcommand,
+                    rule=self.option_rule(build_cache)),
+            min=1, max=10, name='%s_options' % self.subcommand)
+        CompoundRule.__init__(
+            self, spec='%s [<%s_options>]' % (self.subcommand, self.subcommand),
+            extras=[options])
 
-class GitAddOptionRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands('git_add_options', {
+    def value(self, node):
+        return self.subcommand + ' ' + recurse_values(node, (self.option_rule,))
+
+
+class GitAddOptionRule(GitOptionRule):
+    config = 'git_add_options'
+    options = {
         'dry run': '--dry-run ',
         'verbose': '--verbose ',
         'force': '--force ',
@@ -39,22 +86,17 @@ class GitAddOptionRule(MappingRule):
         'refresh': '--refresh ',
         'ignore errors': '--ignore-errors ',
         'ignore missing': '--ignore-missing '
-    })
-add_option = RuleRef(name='add_option', rule=GitAddOptionRule())
-add_options = Repetition(add_option, min=1, max=10, name='add_options')
-
+    }
 
-class GitAddRule(CompoundRule):
-    spec = "add [<add_options>]"
-    extras = [add_options]
 
-    def value(self, node):
-        return 'add ' + recurse_values(node, [GitAddOptionRule])
-add_rule = RuleRef(name='add_rule', rule=GitAddRule())
+class GitAddRule(GitSubcommandRule):
+    subcommand = 'add'
+    option_rule = GitAddOptionRule
 
 
-class GitCommitOptionRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands('git_commit_options', {
+class GitCommitOptionRule(GitOptionRule):
+    config = 'git_commit_options'
+    options = {
         'all': '--all ',
         'patch': '--patch ',
         'reuse message': '--reuse-message="',
@@ -89,59 +131,40 @@ class GitCommitOptionRule(MappingRule):
         'no status': '--no-status ',
         # TODO: add cleanup and options
         # TODO: add mode and options
-    })
-commit_option = RuleRef(
-    name='commit_option', rule=GitCommitOptionRule()
-)
-commit_options = Repetition(
-    commit_option, min=1, max=10, name='commit_options'
-)
+    }
 
 
-class GitCommitRule(CompoundRule):
-    spec = 'commit [<commit_options>]'
-    extras = [commit_options]
+class GitCommitRule(GitSubcommandRule):
+    subcommand = 'commit'
+    option_rule = GitCommitOptionRule
 
-    def value(self, node):
-        return 'commit ' + recurse_values(node, [GitCommitOptionRule])
-commit_rule = RuleRef(name='commit_rule', rule=GitCommitRule())
-
-
-class GitCheckoutOptionRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands(
-        'git_checkout_options', {
-            'quiet': '--quiet ',
-            'force': '--force ',
-            'ours': '--ours ',
-            'theirs': '--theirs ',
-            'branch': '-b ',
-            'track': '--track ',
-            'no track': '--no-track ',
-            'detatch': '--detach ',
-            'orphan': '--orphan ',
-            'ignore skip worktree bits': '--ignore-skip-worktree-bits ',
-            'merge': '--merge ',
-            'patch': '--patch ',
-        })
-checkout_option = RuleRef(
-    name='checkout_option', rule=GitCheckoutOptionRule()
-)
-checkout_options = Repetition(
-    checkout_option, min=1, max=10, name="checkout_options"
-)
 
+class GitCheckoutOptionRule(GitOptionRule):
+    config = 'git_checkout_options'
+    options = {
+        'quiet': '--quiet ',
+        'force': '--force ',
+        'ours': '--ours ',
+        'theirs': '--theirs ',
+        'branch': '-b ',
+        'track': '--track ',
+        'no track': '--no-track ',
+        'detatch': '--detach ',
+        'orphan': '--orphan ',
+        'ignore skip worktree bits': '--ignore-skip-worktree-bits ',
+        'merge': '--merge ',
+        'patch': '--patch ',
+    }
 
-class GitCheckoutRule(CompoundRule):
-    spec = 'checkout [<checkout_options>]'
-    extras = [checkout_options]
 
-    def value(self, node):
-        return 'checkout ' + recurse_values(node, [GitCheckoutOptionRule])
-checkout_rule = RuleRef(name='checkout_rule', rule=GitCheckoutRule())
+class GitCheckoutRule(GitSubcommandRule):
+    subcommand = 'checkout'
+    option_rule = GitCheckoutOptionRule
 
 
-class GitPushOptionRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands('git_push_options', {
+class GitPushOptionRule(GitOptionRule):
+    config = 'git_push_options'
+    options = {
         "all": "--all ",
         "prune": "--prune ",
         "mirror": "--mirror ",
@@ -150,42 +173,27 @@ class GitPushOptionRule(MappingRule):
         "tags": "--tags ",
         "force": "--force ",
         "set upstream": "--set-upstream ",
-    })
-push_option = RuleRef(name="push_option", rule=GitPushOptionRule())
-push_options = Repetition(push_option, min=1, max=10, name="push_options")
-
+    }
 
-class GitPushRule(CompoundRule):
-    spec = "push [<push_options>]"
-    extras = [push_options]
 
-    def value(self, node):
-        return "push " + recurse_values(node, [GitPushOptionRule])
-push_rule = RuleRef(name="push_rule", rule=GitPushRule())
+class GitPushRule(GitSubcommandRule):
+    subcommand = 'push'
+    option_rule = GitPushOptionRule
 
 
-class GitStatusRuleOption(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands('git_status_options', {
+class GitStatusRuleOption(GitOptionRule):
+    config = 'git_status_options'
+    options = {
         "short": "--short ",
         "branch": "--branch ",
         "long": "--long ",
         "ignored": "--ignored ",
-    })
-status_option = RuleRef(
-    name="status_option", rule=GitStatusRuleOption()
-)
-status_options = Repetition(
-    status_option, min=1, max=10, name="status_options"
-)
-
+    }
 
-class GitStatusRule(CompoundRule):
-    spec = "status [<status_options>]"
-    extras = [status_options]
 
-    def value(self, node):
-        return "status " + recurse_values(node, [GitStatusRuleOption])
-status_rule = RuleRef(name="status_rule", rule=GitStatusRule())
+class GitStatusRule(GitSubcommandRule):
+    subcommand = 'status'
+    option_rule = GitStatusRuleOption
 
 
 class GitPrettyFormatRule(MappingRule):
@@ -198,123 +206,117 @@ class GitPrettyFormatRule(MappingRule):
         "email": "email ",
         "raw": "raw ",
     }
-pretty_format_rule = RuleRef(
-    name="pretty_format_rule", rule=GitPrettyFormatRule()
-)
 
 
 class GitPrettyRule(CompoundRule):
     spec = "pretty <pretty_format_rule>"
-    extras = [pretty_format_rule]
+
+    def __init__(self):
+        CompoundRule.__init__(self, extras=[RuleRef(
+            name="pretty_format_rule", rule=GitPrettyFormatRule())])
 
     def value(self, node):
         return "--pretty=" + recurse_values(node, [GitPrettyFormatRule])
-pretty_rule = RuleRef(name="pretty_rule", rule=GitPrettyRule())
-pretty_rules = Alternative(name="pretty_rules", children=[
-    pretty_rule
-])
 
 
 class GitLogOptionRule(CompoundRule):
     # TODO: expand this class to use more than a single "pretty" rule
     spec = "<pretty_rules>"
-    extras = [pretty_rules]
+
+    def __init__(self):
+        CompoundRule.__init__(self, extras=[Alternative(
+            name="pretty_rules",
+            children=[RuleRef(name="pretty_rule", rule=GitPrettyRule())])])
 
     def value(self, node):
         return '' + recurse_values(node, [GitPrettyRule])
-log_option = RuleRef(name="log_option", rule=GitLogOptionRule())
 
 
 class GitLogRule(CompoundRule):
     spec = "log [<log_option>]"
-    extras = [log_option]
+
+    def __init__(self):
+        CompoundRule.__init__(self, extras=[RuleRef(
+            name="log_option", rule=GitLogOptionRule())])
 
     def value(self, node):
         return "log "
-log_rule = RuleRef(name="log_option", rule=GitLogRule())
-
-
-class GitBranchOptionRule(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands(
-        'git_branch_options', {
-            'delete': '--delete ',
-            'force': '--force ',
-            'move': '--move ',
-            'remotes': '--remotes ',
-            'quiet': '--quite ',
-        }
-    )
-branch_option = RuleRef(
-    name="branch_option", rule=GitBranchOptionRule()
-)
-branch_options = Repetition(
-    branch_option, min=1, max=10, name="branch_options"
-)
-
 
-class GitBranchRule(CompoundRule):
-    spec = "branch [<branch_options>]"
-    extras = [branch_options]
-
-    def value(self, node):
-        return "branch " + recurse_values(node, [GitBranchOptionRule])
-branch_rule = RuleRef(name="branch_rule", rule=GitBranchRule())
 
+class GitBranchOptionRule(GitOptionRule):
+    config = 'git_branch_options'
+    options = {
+        'delete': '--delete ',
+        'force': '--force ',
+        'move': '--move ',
+        'remotes': '--remotes ',
+        'quiet': '--quite ',
+    }
 
-class GitPullOption(MappingRule):
-    mapping = aenea.configuration.make_grammar_commands(
-        "git_pull_options", {
-            "quiet": "--quiet ",
-            "verbose": "--verbose ",
-            "rebase": "--rebase ",
-            "force": "--force ",
-        }
-    )
-pull_option = RuleRef(name="pull_option", rule=GitPullOption())
-pull_options = Repetition(pull_option, min=1, max=10, name="pull_options")
 
+class GitBranchRule(GitSubcommandRule):
+    subcommand = 'branch'
+    option_rule = GitBranchOptionRule
 
-class GitPullRule(CompoundRule):
-    spec = "pull [<pull_options>]"
-    extras = [pull_options]
 
-    def value(self, node):
-        return "pull " + recurse_values(node, [GitPullOption])
-pull_rule = RuleRef(name="pull_rule", rule=GitPullRule())
+class GitPullOption(GitOptionRule):
+    config = 'git_pull_options'
+    options = {
+        "quiet": "--quiet ",
+        "verbose": "--verbose ",
+        "rebase": "--rebase ",
+        "force": "--force ",
+    }
 
 
-git_command = Alternative(name='command', children=[
-    add_rule,
-    commit_rule,
-    checkout_rule,
-    push_rule,
-    status_rule,
-    log_rule,
-    branch_rule,
-    pull_rule,
-])
+class GitPullRule(GitSubcommandRule):
+    subcommand = 'pull'
+    option_rule = GitPullOption
 
 
+@aenea_grammars.instrument.instrumented
 class GitRule(CompoundRule):
     spec = 'git <command>'
-    extras = [git_command]
+    extract = aenea_grammars.extract.Extractor('command')
+
+    def __init__(self, build_cache):
+        subcommands = [
+            GitAddRule(build_cache),
+            GitCommitRule(build_cache),
+            GitCheckoutRule(build_cache),
+            GitPushRule(build_cache),
+            GitStatusRule(build_cache),
+            GitLogRule(),
+            GitBranchRule(build_cache),
+            GitPullRule(build_cache),
+            ]
+        CompoundRule.__init__(self, extras=[Alternative(
+            name='command',
+            children=[RuleRef(rule=subcommand) for subcommand in subcommands])])
 
     def process_recognition(self, node):
         self.value(node).execute()
 
     def value(self, node):
-        cmd = node.children[0].children[0].children[1].children[0].children[0]
-        value = Text('git ' + cmd.value())
+        value = aenea.Text('git ' + self.extract(node)['command'])
         return value
 
 
-git_grammar = Grammar('git')
-git_grammar.add_rule(GitRule())
+def build_grammar(grammar):
+    # Every rule is created afresh, so that the grammar can be rebuilt when
+    # the configuration changes.
+    build_cache = aenea_grammars.cache.BuildCache(
+        'git', __file__, configs=GIT_CONFIGS)
+    grammar.add_rule(GitRule(build_cache))
+
+git_grammar = aenea_grammars.reload.ReloadableGrammar('git', build_grammar)
 git_grammar.load()
+reloader = aenea_grammars.reload.Reloader(GIT_CONFIGS, git_grammar)
 
 
 def unload():
     global git_grammar
+    reloader.stop()
     if git_grammar:
         git_grammar.unload()
     git_grammar = None
@@ -9,10 +9,18 @@
 #
 
 import aenea
-import aenea.misc
 import aenea.vocabulary
 import aenea.configuration
-import aenea.format
+
+import aenea_grammars.batch
+import aenea_grammars.cache
+import aenea_grammars.context
+import aenea_grammars.extract
+import aenea_grammars.instrument
+import aenea_grammars.pipeline
+import aenea_grammars.reload
+import aenea_grammars.rules
+import aenea_grammars.vocabulary
 
 from aenea import (
     AeneaContext,
@@ -20,23 +28,15 @@ from aenea import (
     Alternative,
     CompoundRule,
     Dictation,
-    DictList,
     DictListRef,
-    Grammar,
-    IntegerRef,
     Literal,
-    ProxyAppContext,
     MappingRule,
     NeverContext,
     Repetition,
-    RuleRef,
-    Sequence
+    RuleRef
     )
 
-from aenea import (
-    Key,
-    Text
-    )
+from aenea_grammars.actions import Key
 
 # Multiedit wants to take over dynamic vocabulary management.
 MULTIEDIT_TAGS = ['multiedit', 'multiedit.count']
@@ -45,8 +45,7 @@ aenea.vocabulary.inhibit_global_dynamic_vocabulary('multiedit', MULTIEDIT_TAGS)
 #---------------------------------------------------------------------------
 # Set up this module's configuration.
 
-
-command_table = aenea.configuration.make_grammar_commands('multiedit', {
+multiedit_commands = {
     #### Cursor manipulation
     'up [<n>]':    Key('up:%(n)d'),
     'down [<n>]':  Key('down:%(n)d'),
@@ -87,34 +86,7 @@ command_table = aenea.configuration.make_grammar_commands('multiedit', {
     #### Words
     'bump [<n>]':      Key('cs-right:%(n)d, del'),
     'whack [<n>]':     Key('cs-left:%(n)d, del'),
-    }, config_key='commands')
-
-
-class FormatRule(CompoundRule):
-    spec = ('[upper | natural] ( proper | camel | rel-path | abs-path | score | sentence | '
-            'scope-resolve | jumble | dotword | dashword | natword | snakeword | brooding-narrative) [<dictation>]')
-    extras = [Dictation(name='dictation')]
-
-    def value(self, node):
-        words = node.words()
-
-        uppercase = words[0] == 'upper'
-        lowercase = words[0] != 'natural'
-
-        if lowercase:
-            words = [word.lower() for word in words]
-        if uppercase:
-            words = [word.upper() for word in words]
-
-        words = [word.split('\\', 1)[0].replace('-', '') for word in words]
-        if words[0].lower() in ('upper', 'natural'):
-            del words[0]
-
-        function = getattr(aenea.format, 'format_%s' % words[0].lower())
-        formatted = function(words[1:])
-
-        return Text(formatted)
-
+    }
 
 #---------------------------------------------------------------------------
 # Here we define the keystroke rule.
@@ -136,122 +108,48 @@ class FormatRule(CompoundRule):
 class KeystrokeRule(MappingRule):
     exported = False
 
-    extras = [
-        IntegerRef('n', 1, 100),
-        Dictation('text'),
-        Dictation('text2'),
-        ]
-
     defaults = {
         'n': 1,
         }
 
 
-# TODO: this can NOT be the right way to do this...
 class NumericDelegateRule(CompoundRule):
+    # Name of the extra which is repeated n times.
+    delegate = None
+
+    def __init__(self, *args, **kwargs):
+        CompoundRule.__init__(self, *args, **kwargs)
+        self.extract = aenea_grammars.extract.Extractor(self.delegate, 'n')
+
     def value(self, node):
-        delegates = node.children[0].children[0].children
-        value = delegates[0].value()
-        if delegates[-1].value() is not None:
-            return value * int(delegates[-1].value())
+        extras = self.extract(node)
+        value = extras[self.delegate]
+        if extras.get('n') is not None:
+            return value * int(extras['n'])
         else:
             return value
 
 
 class StaticCountRule(NumericDelegateRule):
     spec = '<static> [<n>]'
-
-    extras = [
-        IntegerRef('n', 1, 100),
-        DictListRef(
-            'static',
-            DictList(
-                'static multiedit.count',
-                aenea.vocabulary.get_static_vocabulary('multiedit.count')
-                )),
-        ]
+    delegate = 'static'
 
 class DynamicCountRule(NumericDelegateRule):
     spec = '<dynamic> [<n>]'
-
-    extras = [
-        IntegerRef('n', 1, 100),
-        DictListRef('dynamic', aenea.vocabulary.register_dynamic_vocabulary('multiedit.count')),
-        ]
+    delegate = 'dynamic'
 
     defaults = {
         'n': 1,
         }
 
-#---------------------------------------------------------------------------
-# Here we create an element which is the sequence of keystrokes.
-
-# First we create an element that references the keystroke rule.
-#  Note: when processing a recognition, the *value* of this element
-#  will be the value of the referenced rule: an action.
-
-
-mapping = dict((key, val) for (key, val) in command_table.iteritems())
-
-format_rule = RuleRef(name='format_rule', rule=FormatRule(name='i'))
-alternatives = [
-    RuleRef(rule=KeystrokeRule(mapping=mapping, name='c')),
-    DictListRef(
-        'dynamic multiedit',
-        aenea.vocabulary.register_dynamic_vocabulary('multiedit')
-        ),
-    DictListRef(
-        'static multiedit',
-        DictList(
-            'static multiedit',
-            aenea.vocabulary.get_static_vocabulary('multiedit')
-            ),
-        ),
-    RuleRef(rule=DynamicCountRule(name='aoeuazzzxt'), name='aouxxxazsemi'),
-    RuleRef(rule=StaticCountRule(name='aioeuazzzxt'), name='aouxxxazsemii'),
-    format_rule,
-    ]
-
-single_action = Alternative(alternatives)
-
-# Can only be used as the last element
-alphabet_mapping = dict((key, Text(value))
-                        for (key, value) in aenea.misc.LETTERS.iteritems())
-numbers_mapping = dict((key, Text(value))
-                        for (key, value) in aenea.misc.DIGITS.iteritems())
-alphanumeric_mapping = dict((key, Text(value))
-                            for (key, value) in aenea.misc.ALPHANUMERIC.iteritems())
-
-alphabet_rule = Sequence([Literal('letters'), Repetition(RuleRef(name='x', rule=MappingRule(name='t', mapping=alphabet_mapping)), min=1, max=20)])
-numbers_rule = Sequence([Literal('digits'), Repetition(RuleRef(name='y', rule=MappingRule(name='u', mapping=numbers_mapping)), min=1, max=20)])
-alphanumeric_rule = Sequence([Literal('alphanumeric'), Repetition(RuleRef(name='z', rule=MappingRule(name='v', mapping=alphanumeric_mapping)), min=1, max=20)])
-finishes = [alphabet_rule, numbers_rule, alphanumeric_rule]
-
-# Second we create a repetition of keystroke elements.
-#  This element will match anywhere between 1 and 16 repetitions
-#  of the keystroke elements.  Note that we give this element
-#  the name 'sequence' so that it can be used as an extra in
-#  the rule definition below.
-# Note: when processing a recognition, the *value* of this element
-#  will be a sequence of the contained elements: a sequence of
-#  actions.
-sequence = Repetition(single_action, min=1, max=16, name='sequence')
-
-extras = [
-    sequence,  # Sequence of actions defined above.
-    IntegerRef('n', 1, 100),  # Times to repeat the sequence.
-    Alternative([Literal('hi')], name='finish'),
-    ]
-
 #---------------------------------------------------------------------------
 # Here we define the top-level rule which the user can say.
 
 
+@aenea_grammars.instrument.instrumented
 class LiteralRule(CompoundRule):
     spec = 'literal <format_rule>'
 
-    extras = [format_rule]
-
     def _process_recognition(self, node, extras):
         extras['format_rule'].execute(extras)
 
@@ -261,6 +159,7 @@ class LiteralRule(CompoundRule):
 #  recognition in the 'extras' argument: the sequence of
 #  actions and the number of times to repeat them.
 
+@aenea_grammars.instrument.instrumented
 class RepeatRule(CompoundRule):
     # Here we define this rule's spoken-form and special elements.
     spec = '[ <sequence> ] [ ( literal <format_rule> )  | <finish> ] [repeat <n> times]'
@@ -277,16 +176,130 @@ class RepeatRule(CompoundRule):
     #   . extras['sequence'] gives the sequence of actions.
     #   . extras['n'] gives the repeat count.
     def _process_recognition(self, node, extras):
-        sequence = extras.get('sequence', [])
-        count = extras['n']
-        for i in range(count):
-            for action in sequence:
-                action.execute(extras)
-            if 'format_rule' in extras:
-                extras['format_rule'].execute(extras)
-            if 'finish' in extras:
-                for action in extras['finish'][1]:
-                    action.execute(extras)
+        actions = list(extras.get('sequence', []))
+        repeat = extras['n']
+        if 'format_rule' in extras:
+            formatted = extras['format_rule']
+            if not actions and 'finish' not in extras:
+                # Repeated on its own, the text is pasted (or typed) once.
+                formatted, repeat = formatted * repeat, 1
+            elif repeat > 1:
+                # Pasting between other actions would save and restore the
+                # clipboard on every repeat.
+                formatted = formatted.typed()
+            actions.append(formatted)
+        if 'finish' in extras:
+            actions.extend(extras['finish'][1])
+        # Flatten the repeats and send everything to the proxy in one go,
+        # without waiting for it to be typed.
+        aenea_grammars.batch.execute(actions * repeat, extras, pipelined=True)
+
+#---------------------------------------------------------------------------
+# Here we create an element which is the sequence of keystrokes. Every rule
+# and list is created afresh each time the grammar is built, so that it can
+# be rebuilt when the configuration changes.
+
+# Vocabulary lists made by each build, by id of its grammar. Builds may run
+# on the reloader's thread, so the lists start out empty and are only
+# registered, on the engine thread, when their grammar is loaded.
+_vocabulary_lists = {}
+_registered_lists = {}
+
+_REGISTER = {
+    'dynamic': (aenea_grammars.vocabulary.register_dynamic_vocabulary,
+                aenea_grammars.vocabulary.unregister_dynamic_vocabulary),
+    'static': (aenea_grammars.vocabulary.register_static_vocabulary,
+               aenea_grammars.vocabulary.unregister_static_vocabulary),
+    }
+
+
+def vocabulary(grammar, kind, tag):
+    dict_list = aenea_grammars.vocabulary.vocabulary_list(kind, tag)
+    _vocabulary_lists.setdefault(id(grammar), []).append((kind, tag, dict_list))
+    return dict_list
+
+
+def register_vocabulary(grammar):
+    lists = _vocabulary_lists.pop(id(grammar), [])
+    for (kind, tag, dict_list) in lists:
+        _REGISTER[kind][0](tag, dict_list)
+    _registered_lists[id(grammar)] = lists
+
+
+def release_vocabulary(grammar):
+    _vocabulary_lists.pop(id(grammar), None)
+    for (kind, tag, dict_list) in _registered_lists.pop(id(grammar), ()):
+        _REGISTER[kind][1](tag, dict_list)
+
+
+def build_grammar(grammar):
+    build_cache = aenea_grammars.cache.BuildCache(
+        'multiedit', __file__, configs=['multiedit'])
+    mapping = build_cache.grammar_commands(
+        'multiedit', multiedit_commands, config_key='commands')
+
+    # First we create an element that references the keystroke rule.
+    #  Note: when processing a recognition, the *value* of this element
+    #  will be the value of the referenced rule: an action.
+    format_rule = RuleRef(name='format_rule', rule=aenea_grammars.rules.FormatRule(
+        'multiedit', name='i'))
+    dynamic_count_rule = DynamicCountRule(name='aoeuazzzxt', extras=[
+        aenea_grammars.rules.integer_ref('n', 1, 100),
+        DictListRef('dynamic', vocabulary(grammar, 'dynamic', 'multiedit.count')),
+        ])
+    static_count_rule = StaticCountRule(name='aioeuazzzxt', extras=[
+        aenea_grammars.rules.integer_ref('n', 1, 100),
+        DictListRef('static', vocabulary(grammar, 'static', 'multiedit.count')),
+        ])
+    alternatives = [
+        RuleRef(rule=KeystrokeRule(mapping=mapping, name='c', extras=[
+            aenea_grammars.rules.integer_ref('n', 1, 100),
+            Dictation('text'),
+            Dictation('text2'),
+            ])),
+        DictListRef(
+            'dynamic multiedit',
+            vocabulary(grammar, 'dynamic', 'multiedit')
+            ),
+        DictListRef(
+            'static multiedit',
+            vocabulary(grammar, 'static', 'multiedit')
+            ),
+        RuleRef(rule=dynamic_count_rule, name='aouxxxazsemi'),
+        RuleRef(rule=static_count_rule, name='aouxxxazsemii'),
+        format_rule,
+        ]
+
+    single_action = Alternative(alternatives)
+
+    # These can only be used as the last element.
+    alphabet_rule = aenea_grammars.rules.spelled(
+        'letters', aenea_grammars.rules.LETTER_TEXT, 'x', 't')
+    numbers_rule = aenea_grammars.rules.spelled(
+        'digits', aenea_grammars.rules.DIGIT_TEXT, 'y', 'u')
+    alphanumeric_rule = aenea_grammars.rules.spelled(
+        'alphanumeric', aenea_grammars.rules.ALPHANUMERIC_TEXT, 'z', 'v')
+    finishes = [alphabet_rule, numbers_rule, alphanumeric_rule]
+
+    # Second we create a repetition of keystroke elements.
+    #  This element will match anywhere between 1 and 16 repetitions
+    #  of the keystroke elements.  Note that we give this element
+    #  the name 'sequence' so that it can be used as an extra in
+    #  the rule definition below.
+    # Note: when processing a recognition, the *value* of this element
+    #  will be a sequence of the contained elements: a sequence of
+    #  actions.
+    sequence = Repetition(single_action, min=1, max=16, name='sequence')
+
+    extras = [
+        sequence,  # Sequence of actions defined above.
+        # Times to repeat the sequence.
+        aenea_grammars.rules.integer_ref('n', 1, 100),
+        Alternative([Literal('hi')], name='finish'),
+        ]
+
+    grammar.add_rule(RepeatRule(extras=extras + [format_rule, Alternative(finishes, name='finish')], name='a'))
+    grammar.add_rule(LiteralRule(extras=[format_rule]))
 
 #---------------------------------------------------------------------------
 # Create and load this module's grammar.
@@ -310,32 +323,37 @@ if proxy_disable_setting is not None:
         d = {}
         for k, v in proxy_disable_setting.iteritems():
             d[str(k)] = str(v)
-        proxy_disable_context = ProxyAppContext(**d)
+        proxy_disable_context = aenea_grammars.context.ProxyAppContext(**d)
     else:
-        proxy_disable_context = ProxyAppContext(
+        proxy_disable_context = aenea_grammars.context.ProxyAppContext(
             title=str(proxy_disable_setting),
             match='substring'
             )
 
 
 context = AeneaContext(proxy_disable_context, local_disable_context)
+aenea_grammars.context.subscribe()
+aenea_grammars.pipeline.start()
 
-grammar = Grammar('multiedit', context=~context)
-grammar.add_rule(RepeatRule(extras=extras + [format_rule, Alternative(finishes, name='finish')], name='a'))
-grammar.add_rule(LiteralRule())
-
+grammar = aenea_grammars.reload.ReloadableGrammar(
+    'multiedit', build_grammar, context=~context, attach=register_vocabulary,
+    release=release_vocabulary)
 grammar.load()
+reloader = aenea_grammars.reload.Reloader(['multiedit'], grammar)
 
 
 # Unload function which will be called at unload time.
 def unload():
     global grammar
+    reloader.stop()
+    aenea_grammars.context.unsubscribe()
+    aenea_grammars.pipeline.stop()
     aenea.vocabulary.uninhibit_global_dynamic_vocabulary(
         'multiedit',
         MULTIEDIT_TAGS
         )
     for tag in MULTIEDIT_TAGS:
-        aenea.vocabulary.unregister_dynamic_vocabulary(tag)
+        aenea_grammars.vocabulary.unregister_dynamic_vocabulary(tag)
     if grammar:
         grammar.unload()
     grammar = None
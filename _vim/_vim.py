@@ -6,44 +6,51 @@
 LEADER = 'comma'
 
 import aenea.config
-import aenea.misc
 import aenea.vocabulary
 
-from aenea import (
+import aenea_grammars.batch
+import aenea_grammars.context
+import aenea_grammars.extract
+import aenea_grammars.instrument
+import aenea_grammars.lazy
+import aenea_grammars.paste
+import aenea_grammars.pipeline
+import aenea_grammars.rules
+import aenea_grammars.vocabulary
+
+from aenea import NoAction
+
+from aenea_grammars.actions import (
     Key,
-    NoAction,
     Text
     )
 
-from aenea.proxy_contexts import ProxyAppContext
-
 from dragonfly import (
     Alternative,
     AppContext,
     CompoundRule,
-    Dictation,
-    Grammar,
     MappingRule,
     Repetition,
     RuleRef
     )
 
 vim_context = aenea.wrappers.AeneaContext(
-    ProxyAppContext(match='regex', title='(?i).*VIM.*'),
+    aenea_grammars.context.ProxyAppContext(match='regex', title='(?i).*VIM.*'),
     AppContext(title='VIM')
     )
 
 command_t_context = aenea.wrappers.AeneaContext(
-    ProxyAppContext(match='regex', title='^GoToFile.*$'),
+    aenea_grammars.context.ProxyAppContext(match='regex', title='^GoToFile.*$'),
     AppContext(title='GoToFile')
     ) & vim_context
 
 fugitive_index_context = aenea.wrappers.AeneaContext(
-    ProxyAppContext(match='regex', title='^index.*\.git.*$'),
+    aenea_grammars.context.ProxyAppContext(match='regex', title='^index.*\.git.*$'),
     AppContext(title='index') & AppContext('.git')
     ) & vim_context
 
-grammar = Grammar('vim', context=vim_context)
+aenea_grammars.context.subscribe()
+aenea_grammars.pipeline.start()
 
 from dragonfly import DictListRef
 
@@ -51,46 +58,75 @@ VIM_TAGS = ['vim.insertions.code', 'vim.insertions']
 aenea.vocabulary.inhibit_global_dynamic_vocabulary('vim', VIM_TAGS, vim_context)
 
 
-# TODO: this can NOT be the right way to do this...
 class NumericDelegateRule(CompoundRule):
+    # Name of the extra which the optional count is prefixed to.
+    delegate = None
+
+    def __init__(self, *args, **kwargs):
+        CompoundRule.__init__(self, *args, **kwargs)
+        self.extract = aenea_grammars.extract.Extractor('count', self.delegate)
+
     def value(self, node):
-        delegates = node.children[0].children[0].children
-        value = delegates[-1].value()
-        if delegates[0].value() is not None:
-            return Text('%s' % delegates[0].value()) + value
+        extras = self.extract(node)
+        value = extras[self.delegate]
+        if extras.get('count') is not None:
+            return aenea.Text('%s' % extras['count']) + value
         else:
             return value
 
 
-class _DigitalIntegerFetcher(object):
-    def __init__(self):
-        self.cached = {}
-
-    def __getitem__(self, length):
-        if length not in self.cached:
-            self.cached[length] = aenea.misc.DigitalInteger('count', 1, length)
-        return self.cached[length]
-ruleDigitalInteger = _DigitalIntegerFetcher()
+# A count of up to two digits.
+ruleCount = aenea_grammars.rules.digital_integer('count', 1, 3)
 
 
-class LetterMapping(MappingRule):
-    mapping = aenea.misc.LETTERS
-ruleLetterMapping = RuleRef(LetterMapping(), name='LetterMapping')
+ruleLetterMapping = RuleRef(aenea_grammars.rules.LetterMapping(),
+                            name='LetterMapping')
 
 
-def execute_insertion_buffer(insertion_buffer):
+def compile_insertion_buffer(insertion_buffer):
+    '''Insertions are (entry, action) or (entry, action, count). A count on
+       the insertion that opens the buffer is given to vim with the entry, so
+       that vim does the repeating; later counts are repeated here.'''
     if not insertion_buffer:
-        return
+        return []
+
+    entry = insertion_buffer[0][0]
+    if entry is None:
+        entry = Key('a')
+
+    program = []
+    typed = []
+    for (i, insertion) in enumerate(insertion_buffer):
+        if len(insertion) < 3:
+            typed.append(insertion[1])
+        elif i == 0:
+            program.extend([aenea.Text('%d' % insertion[2]), entry,
+                            insertion[1], Key('escape:2')])
+            # gi resumes where insert mode stopped; a would be one character
+            # off at the start of a line, where escape leaves the cursor be.
+            entry = Key('g, i')
+        else:
+            typed.append(insertion[1] * insertion[2])
 
-    if insertion_buffer[0][0] is not None:
-        insertion_buffer[0][0].execute()
-    else:
-        Key('a').execute()
+    if typed or not program:
+        program.extend([entry] + typed + [Key('escape:2')])
+    return program
 
-    for insertion in insertion_buffer:
-        insertion[1].execute()
 
-    Key('escape:2').execute()
+def compile_commands(commands):
+    '''Turn a list of ('c', action) and ('i', (entry, action)) pairs into a
+       flat list of actions, opening and closing insert mode as needed.'''
+    program = []
+    insertion_buffer = []
+    for mode, command in commands:
+        if mode == 'i':
+            insertion_buffer.append(command)
+        else:
+            program.extend(compile_insertion_buffer(insertion_buffer))
+            insertion_buffer = []
+            program.append(command)
+    program.extend(compile_insertion_buffer(insertion_buffer))
+    return program
 
 # ****************************************************************************
 # IDENTIFIERS
@@ -104,102 +140,31 @@ class InsertModeEntry(MappingRule):
         'phyllo': Key('o'),
         'phyhigh': Key('O'),
         }
-ruleInsertModeEntry = RuleRef(InsertModeEntry(), name='InsertModeEntry')
-
-
-def format_snakeword(text):
-    formatted = text[0][0].upper()
-    formatted += text[0][1:]
-    formatted += ('_' if len(text) > 1 else '')
-    formatted += format_score(text[1:])
-    return formatted
-
-
-def format_score(text):
-    return '_'.join(text)
-
-
-def format_camel(text):
-    return text[0] + ''.join([word[0].upper() + word[1:] for word in text[1:]])
-
-
-def format_proper(text):
-    return ''.join(word.capitalize() for word in text)
-
-
-def format_relpath(text):
-    return '/'.join(text)
-
-
-def format_abspath(text):
-    return '/' + format_relpath(text)
-
-
-def format_scoperesolve(text):
-    return '::'.join(text)
-
-
-def format_jumble(text):
-    return ''.join(text)
 
+# Entries where a count just repeats the inserted text (a count before o
+# opens that many lines instead).
+COUNTED_ENTRIES = frozenset(['inns', 'syn'])
+ruleInsertModeEntry = RuleRef(InsertModeEntry(), name='InsertModeEntry')
 
-def format_dotword(text):
-    return '.'.join(text)
-
-
-def format_dashword(text):
-    return '-'.join(text)
-
-
-def format_natword(text):
-    return ' '.join(text)
-
-
-def format_broodingnarrative(text):
-    return ''
-
-
-def format_sentence(text):
-    return ' '.join([text[0].capitalize()] + text[1:])
-
-
-class IdentifierInsertion(CompoundRule):
-    spec = ('[upper | natural] ( proper | camel | rel-path | abs-path | score | sentence |'
-            'scope-resolve | jumble | dotword | dashword | natword | snakeword | brooding-narrative) [<dictation>]')
-    extras = [Dictation(name='dictation')]
-
-    def value(self, node):
-        words = node.words()
-
-        uppercase = words[0] == 'upper'
-        lowercase = words[0] != 'natural'
-
-        if lowercase:
-            words = [word.lower() for word in words]
-        if uppercase:
-            words = [word.upper() for word in words]
-
-        words = [word.split('\\', 1)[0].replace('-', '') for word in words]
-        if words[0].lower() in ('upper', 'natural'):
-            del words[0]
-
-        function = globals()['format_%s' % words[0].lower()]
-        formatted = function(words[1:])
 
-        return Text(formatted)
+# Vim's insert mode takes ctrl-v literally; shift-insert pastes.
 ruleIdentifierInsertion = RuleRef(
-    IdentifierInsertion(),
+    aenea_grammars.rules.FormatRule(
+        'vim', 's-insert', name='IdentifierInsertion'),
     name='IdentifierInsertion'
     )
 
 
+@aenea_grammars.instrument.instrumented
 class LiteralIdentifierInsertion(CompoundRule):
     spec = '[<InsertModeEntry>] literal <IdentifierInsertion>'
     extras = [ruleIdentifierInsertion, ruleInsertModeEntry]
+    extract = aenea_grammars.extract.Extractor(
+        'InsertModeEntry', 'IdentifierInsertion')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        return [('i', (children[0].value(), children[2].value()))]
+        extras = self.extract(node)
+        return [('i', (extras.get('InsertModeEntry'), extras['IdentifierInsertion']))]
 ruleLiteralIdentifierInsertion = RuleRef(
     LiteralIdentifierInsertion(),
     name='LiteralIdentifierInsertion'
@@ -219,17 +184,16 @@ class KeyInsertion(MappingRule):
         'scratch [<count>]':    Key('backspace:%(count)d'),
         'ack':                  Key('escape'),
         }
-    extras = [ruleDigitalInteger[3]]
+    extras = [ruleCount]
     defaults = {'count': 1}
 ruleKeyInsertion = RuleRef(KeyInsertion(), name='KeyInsertion')
 
 
 class SpellingInsertion(MappingRule):
-    mapping = dict(('dig ' + key, val) for (key, val) in aenea.misc.DIGITS.iteritems())
-    mapping.update(aenea.misc.LETTERS)
+    mapping = aenea_grammars.rules.SPELLING
 
     def value(self, node):
-        return Text(MappingRule.value(self, node))
+        return aenea.Text(MappingRule.value(self, node))
 ruleSpellingInsertion = RuleRef(SpellingInsertion(), name='SpellingInsertion')
 
 
@@ -266,50 +230,32 @@ primitive_insertions = [
     ruleIdentifierInsertion,
     DictListRef(
         'dynamic vim.insertions.code',
-        aenea.vocabulary.register_dynamic_vocabulary('vim.insertions.code')
+        aenea_grammars.vocabulary.register_dynamic_vocabulary('vim.insertions.code')
         ),
     DictListRef(
         'dynamic vim.insertions',
-        aenea.vocabulary.register_dynamic_vocabulary('vim.insertions')
+        aenea_grammars.vocabulary.register_dynamic_vocabulary('vim.insertions')
+        ),
+    DictListRef(
+        'static vim.insertions.code',
+        aenea_grammars.vocabulary.register_static_vocabulary('vim.insertions.code')
+        ),
+    DictListRef(
+        'static vim.insertions',
+        aenea_grammars.vocabulary.register_static_vocabulary('vim.insertions')
         ),
     ruleArithmeticInsertion,
     ruleSpellingInsertion,
     ]
 
 
-static_code_insertions = aenea.vocabulary.get_static_vocabulary('vim.insertions.code')
-static_insertions = aenea.vocabulary.get_static_vocabulary('vim.insertions')
-
-if static_code_insertions:
-    primitive_insertions.append(
-        RuleRef(
-            MappingRule(
-                'static vim.insertions,code mapping',
-                mapping=aenea.vocabulary.get_static_vocabulary('vim.insertions.code')
-                ),
-            'static vim.insertions.code'
-            )
-        )
-
-if static_insertions:
-    primitive_insertions.append(
-        RuleRef(
-            MappingRule(
-                'static vim.insertions mapping',
-                mapping=aenea.vocabulary.get_static_vocabulary('vim.insertions')
-                ),
-            'static vim.insertions'
-            )
-        )
-
-
 class PrimitiveInsertion(CompoundRule):
     spec = '<insertion>'
     extras = [Alternative(primitive_insertions, name='insertion')]
+    extract = aenea_grammars.extract.Extractor('insertion')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        return children[0].value()
+        return self.extract(node)['insertion']
 rulePrimitiveInsertion = RuleRef(
     PrimitiveInsertion(),
     name='PrimitiveInsertion'
@@ -318,26 +264,42 @@ rulePrimitiveInsertion = RuleRef(
 
 class PrimitiveInsertionRepetition(CompoundRule):
     spec = '<PrimitiveInsertion> [ parrot <count> ]'
-    extras = [rulePrimitiveInsertion, ruleDigitalInteger[3]]
+    extras = [rulePrimitiveInsertion, ruleCount]
+    extract = aenea_grammars.extract.Extractor('PrimitiveInsertion', 'count')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        holder = children[1].value()[1] if children[1].value() else 1
-        value = children[0].value() * holder
-        return value
+        extras = self.extract(node)
+        return (extras['PrimitiveInsertion'], extras.get('count', 1))
 rulePrimitiveInsertionRepetition = RuleRef(
     PrimitiveInsertionRepetition(),
     name='PrimitiveInsertionRepetition'
     )
 
 
+@aenea_grammars.instrument.instrumented
 class Insertion(CompoundRule):
     spec = '[<InsertModeEntry>] <PrimitiveInsertionRepetition>'
     extras = [rulePrimitiveInsertionRepetition, ruleInsertModeEntry]
+    extract = aenea_grammars.extract.Extractor(
+        'InsertModeEntry', 'PrimitiveInsertionRepetition')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        return [('i', (children[0].value(), children[1].value()))]
+        nodes = self.extract.nodes(node)
+        insertion, count = nodes['PrimitiveInsertionRepetition'].value()
+        entry = None
+        countable = True
+        if 'InsertModeEntry' in nodes:
+            entry = nodes['InsertModeEntry'].value()
+            spoken = ' '.join(nodes['InsertModeEntry'].words())
+            countable = spoken in COUNTED_ENTRIES
+        if count == 1:
+            return [('i', (entry, insertion))]
+        # Only plain text is safe to leave to vim, pasted or typed; keys such
+        # as arrows would break the repeat.
+        if countable and isinstance(insertion, (Text.cls,
+                                                aenea_grammars.paste.BulkText)):
+            return [('i', (entry, insertion, count))]
+        return [('i', (entry, insertion * count))]
 ruleInsertion = RuleRef(Insertion(), name='Insertion')
 
 
@@ -436,10 +398,13 @@ ruleMotionParameterMotion = RuleRef(
 class ParameterizedMotion(CompoundRule):
     spec = '<MotionParameterMotion> <LetterMapping>'
     extras = [ruleLetterMapping, ruleMotionParameterMotion]
+    extract = aenea_grammars.extract.Extractor(
+        'MotionParameterMotion', 'LetterMapping')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        return Text(children[0].value() + children[1].value())
+        extras = self.extract(node)
+        return aenea.Text(extras['MotionParameterMotion'] +
+                          extras['LetterMapping'])
 ruleParameterizedMotion = RuleRef(
     ParameterizedMotion(),
     name='ParameterizedMotion'
@@ -448,22 +413,25 @@ ruleParameterizedMotion = RuleRef(
 
 class CountedMotion(NumericDelegateRule):
     spec = '[<count>] <motion>'
-    extras = [ruleDigitalInteger[3],
+    delegate = 'motion'
+    extras = [ruleCount,
               Alternative([
                   rulePrimitiveMotion,
                   ruleParameterizedMotion], name='motion')]
 ruleCountedMotion = RuleRef(CountedMotion(), name='CountedMotion')
 
 
+@aenea_grammars.instrument.instrumented
 class Motion(CompoundRule):
     spec = '<motion>'
     extras = [Alternative(
         [ruleCountedMotion, ruleUncountedMotion],
         name='motion'
         )]
+    extract = aenea_grammars.extract.Extractor('motion')
 
     def value(self, node):
-        return node.children[0].children[0].children[0].value()
+        return self.extract(node)['motion']
 
 ruleMotion = RuleRef(Motion(), name='Motion')
 
@@ -499,20 +467,23 @@ rulePrimitiveOperator = RuleRef(PrimitiveOperator(), name='PrimitiveOperator')
 
 class Operator(NumericDelegateRule):
     spec = '[<count>] <PrimitiveOperator>'
-    extras = [ruleDigitalInteger[3],
+    delegate = 'PrimitiveOperator'
+    extras = [ruleCount,
               rulePrimitiveOperator]
 ruleOperator = RuleRef(Operator(), name='Operator')
 
 
+@aenea_grammars.instrument.instrumented
 class OperatorApplicationMotion(CompoundRule):
     spec = '[<Operator>] <Motion>'
     extras = [ruleOperator, ruleMotion]
+    extract = aenea_grammars.extract.Extractor('Operator', 'Motion')
 
     def value(self, node):
-        children = node.children[0].children[0].children
-        return_value = children[1].value()
-        if children[0].value() is not None:
-            return_value = children[0].value() + return_value
+        extras = self.extract(node)
+        return_value = extras['Motion']
+        if extras.get('Operator') is not None:
+            return_value = extras['Operator'] + return_value
         return return_value
 ruleOperatorApplicationMotion = RuleRef(
     OperatorApplicationMotion(),
@@ -520,24 +491,26 @@ ruleOperatorApplicationMotion = RuleRef(
     )
 
 
+@aenea_grammars.instrument.instrumented
 class OperatorSelfApplication(MappingRule):
     mapping = dict(('%s [<count>] %s' % (key, key), Text('%s%%(count)d%s' % (value, value)))
                    for (key, value) in _OPERATORS.iteritems())
     # tComment
     # string not action intentional dirty hack.
     mapping['comm nop [<count>] comm nop'] = 'tcomment'
-    extras = [ruleDigitalInteger[3]]
+    extras = [ruleCount]
     defaults = {'count': 1}
+    extract = aenea_grammars.extract.Extractor('count')
 
     def value(self, node):
         value = MappingRule.value(self, node)
         if value == 'tcomment':
             # ugly hack to get around tComment's not allowing ranges with gcc.
-            value = node.children[0].children[0].children[0].children[1].value()
+            value = self.extract(node).get('count')
             if value in (1, '1', None):
                 return Text('gcc')
             else:
-                return Text('gc%dj' % (int(value) - 1))
+                return aenea.Text('gc%dj' % (int(value) - 1))
         else:
             return value
 
@@ -569,23 +542,25 @@ class PrimitiveCommand(MappingRule):
 rulePrimitiveCommand = RuleRef(PrimitiveCommand(), name='PrimitiveCommand')
 
 
+@aenea_grammars.instrument.instrumented
 class Command(CompoundRule):
     spec = '[<count>] [reg <LetterMapping>] <command>'
     extras = [Alternative([ruleOperatorApplication,
                            rulePrimitiveCommand,
                            ], name='command'),
-              ruleDigitalInteger[3],
+              ruleCount,
               ruleLetterMapping]
+    extract = aenea_grammars.extract.Extractor('count', 'LetterMapping', 'command')
 
     def value(self, node):
-        delegates = node.children[0].children[0].children
-        value = delegates[-1].value()
+        extras = self.extract(node)
+        value = extras['command']
         prefix = ''
-        if delegates[0].value() is not None:
-            prefix += str(delegates[0].value())
-        if delegates[1].value() is not None:
+        if extras.get('count') is not None:
+            prefix += str(extras['count'])
+        if extras.get('LetterMapping') is not None:
             # Hack for macros
-            reg = delegates[1].value()[1]
+            reg = extras['LetterMapping']
             if value == 'macro':
                 prefix += '@' + reg
                 value = None
@@ -593,9 +568,9 @@ class Command(CompoundRule):
                 prefix += "'" + reg
         if prefix:
             if value is not None:
-                value = Text(prefix) + value
+                value = aenea.Text(prefix) + value
             else:
-                value = Text(prefix)
+                value = aenea.Text(prefix)
         # TODO: ugly hack; should fix the grammar or generalize.
         if 'chaos' in zip(*node.results)[0]:
             return [('c', value), ('i', (NoAction(),) * 2)]
@@ -607,38 +582,41 @@ ruleCommand = RuleRef(Command(), name='Command')
 # ****************************************************************************
 
 
+@aenea_grammars.instrument.instrumented
 class VimCommand(CompoundRule):
     spec = ('[<app>] [<literal>]')
     extras = [Repetition(Alternative([ruleCommand, RuleRef(Insertion())]), max=10, name='app'),
               RuleRef(LiteralIdentifierInsertion(), name='literal')]
 
     def _process_recognition(self, node, extras):
-        insertion_buffer = []
         commands = []
         if 'app' in extras:
             for chunk in extras['app']:
                 commands.extend(chunk)
         if 'literal' in extras:
             commands.extend(extras['literal'])
-        for command in commands:
-            mode, command = command
-            if mode == 'i':
-                insertion_buffer.append(command)
-            else:
-                execute_insertion_buffer(insertion_buffer)
-                insertion_buffer = []
-                command.execute(extras)
-        execute_insertion_buffer(insertion_buffer)
+        # The whole utterance goes to the proxy as one batch, so vim never
+        # sees a half-applied command if the link stalls. The engine doesn't
+        # wait for it to be typed.
+        aenea_grammars.batch.execute(compile_commands(commands), extras,
+                                     pipelined=True)
+
 
-grammar.add_rule(VimCommand())
+def build_grammar(grammar):
+    grammar.add_rule(VimCommand())
 
+# The rule tree above is only compiled by the engine once vim has had focus.
+grammar = aenea_grammars.lazy.LazyGrammar('vim', vim_context, build_grammar)
 grammar.load()
 
 
 def unload():
+    aenea_grammars.context.unsubscribe()
+    aenea_grammars.pipeline.stop()
     aenea.vocabulary.uninhibit_global_dynamic_vocabulary('vim', VIM_TAGS)
     for tag in VIM_TAGS:
-        aenea.vocabulary.unregister_dynamic_vocabulary(tag)
+        aenea_grammars.vocabulary.unregister_dynamic_vocabulary(tag)
+        aenea_grammars.vocabulary.unregister_static_vocabulary(tag)
     global grammar
     if grammar:
         grammar.unload()
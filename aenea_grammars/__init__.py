@@ -0,0 +1,3 @@
+# Helpers shared by the grammars in this repository. This directory must be
+# importable from the grammars (copy or symlink it next to them, the same way
+# the grammar modules themselves are installed).
@@ -0,0 +1,61 @@
+# Interned Key and Text actions.
+#
+# The grammars define many identical actions: each mapping has its own
+# Text('k'), vocabularies repeat the same shortcuts, and vim builds the same
+# entry and escape keys for every insertion. Aenea parses a static spec into
+# key events when the action is created, so every copy costs a parse as well
+# as memory. The factories here hand out one shared instance per spec.
+#
+# Shared actions must be treated as immutable. Combining them with + or *
+# makes a new action, as does copy_bind(), so the usual idioms are safe.
+#
+# Only static specs, such as those in mappings, should be interned. Actions
+# built from what was recognized use aenea.Key and aenea.Text directly, so
+# that one-off specs don't fill the table and crowd out later static ones.
+
+import aenea
+
+# Specs remembered per action type. Beyond this, new specs get an action of
+# their own each time.
+MAX_INTERNED = 4096
+
+
+class InternedFactory(object):
+    '''Makes cls actions, sharing one instance between identical specs.'''
+
+    def __init__(self, cls):
+        self.cls = cls
+        self._instances = {}
+
+    def __call__(self, spec, *args, **kwargs):
+        key = spec
+        if args or kwargs:
+            key = (spec, args, tuple(sorted(kwargs.iteritems())))
+        try:
+            return self._instances[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # An unhashable argument; don't share it.
+            return self.cls(spec, *args, **kwargs)
+        action = self.cls(spec, *args, **kwargs)
+        if len(self._instances) < MAX_INTERNED:
+            self._instances[key] = action
+        return action
+
+    def __len__(self):
+        return len(self._instances)
+
+
+_factories = {}
+
+
+def interned(cls):
+    '''The InternedFactory for an action class; one per class.'''
+    if cls not in _factories:
+        _factories[cls] = InternedFactory(cls)
+    return _factories[cls]
+
+
+Key = interned(aenea.Key)
+Text = interned(aenea.Text)
@@ -0,0 +1,179 @@
+# Batched execution of actions over the Aenea proxy.
+#
+# Every proxied Key or Text action normally costs one RPC round trip per
+# call it makes to the server. While a Batch is open, the side-effect-only
+# server calls made by executing actions are recorded instead of sent, and
+# the whole recorded sequence goes out as a single multiple_actions call when
+# the batch closes. Anything else (queries such as get_context, or calls we
+# don't know about) flushes what has been recorded so far and then goes to
+# the server directly, so ordering is always preserved. Actions that execute
+# locally never touch the server and are unaffected.
+#
+# Before a batch is sent it is run-length compressed: adjacent identical key
+# presses become one counted press and adjacent text is joined, which types
+# exactly the same thing in fewer commands.
+#
+# A batch may instead hand its commands to an aenea_grammars.pipeline, which
+# sends them on a background thread while the engine carries on. Servers
+# that accept packed_actions get the batch in the compact encoding of
+# aenea_grammars.wire.
+
+import aenea.communications
+
+import aenea_grammars.instrument
+import aenea_grammars.pipeline
+import aenea_grammars.wire
+
+# Server calls which only have side effects and may therefore be deferred.
+BATCHABLE_CALLS = frozenset([
+    'key_press',
+    'write_text',
+    'click_mouse',
+    'move_mouse',
+    'pause',
+    'set_clipboard',
+    ])
+
+
+def _text(command):
+    name, args, kwargs = command
+    if name != 'write_text' or len(args) + len(kwargs) != 1:
+        return None
+    return args[0] if args else kwargs.get('text')
+
+
+def _counted_press(command):
+    '''(key, modifiers, count) for a plain key press given by keyword, or
+       None for anything it isn't safe to merge.'''
+    name, args, kwargs = command
+    if (name != 'key_press' or args or
+            kwargs.get('direction', 'press') != 'press' or
+            kwargs.get('count_delay') is not None):
+        return None
+    return (kwargs.get('key'), tuple(kwargs.get('modifiers', ())),
+            kwargs.get('count', 1))
+
+
+def compress(commands):
+    '''Merge runs of identical key presses into one counted press and runs of
+       text into one write_text. Presses with a delay are left alone, since
+       the server only waits between the repetitions of a single call.'''
+    compressed = []
+    for command in commands:
+        if compressed:
+            previous = compressed[-1]
+            text, previous_text = _text(command), _text(previous)
+            if text is not None and previous_text is not None:
+                compressed[-1] = ('write_text', (previous_text + text,), {})
+                continue
+            press, previous_press = _counted_press(command), _counted_press(previous)
+            if (press is not None and previous_press is not None and
+                    press[:2] == previous_press[:2]):
+                kwargs = dict(previous[2])
+                kwargs['count'] = previous_press[2] + press[2]
+                compressed[-1] = ('key_press', (), kwargs)
+                continue
+        compressed.append(command)
+    return compressed
+
+
+class _RecordingServer(object):
+    def __init__(self, batch, server):
+        self._batch = batch
+        self._server = server
+
+    def __getattr__(self, name):
+        if name not in BATCHABLE_CALLS:
+            self._batch.flush()
+            return getattr(self._server, name)
+
+        def record(*args, **kwargs):
+            self._batch.commands.append((name, args, kwargs))
+        return record
+
+
+class Batch(object):
+    '''Context manager which collects proxy calls and dispatches them at once.
+       Batches nest; only the outermost one talks to the server, or submits
+       to pipeline if given.'''
+
+    def __init__(self, pipeline=None):
+        self.commands = []
+        self.pipeline = pipeline
+        self._server = None
+
+    def __enter__(self):
+        server = aenea.communications.server
+        if isinstance(server, _RecordingServer):
+            # Nested batch; let the outer one do the dispatching.
+            return self
+        self._server = server
+        aenea.communications.server = _RecordingServer(self, server)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._server is None:
+            return False
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            aenea.communications.server = self._server
+            self._server = None
+        return False
+
+    def flush(self):
+        commands, self.commands = compress(self.commands), []
+        if not commands or self._server is None:
+            return
+        if self.pipeline is not None:
+            self.pipeline.submit(commands)
+        else:
+            send(self._server, commands)
+
+
+# Cleared once the server turns out not to accept packed_actions.
+_packed_supported = True
+
+
+def send(server, commands):
+    '''Send compressed commands to server in as few calls as it supports.'''
+    global _packed_supported
+    if len(commands) == 1:
+        _dispatch_one(server, commands[0])
+        return
+    packed = aenea_grammars.wire.encode(commands) if _packed_supported else None
+    if packed is not None:
+        try:
+            server.packed_actions(packed)
+            return
+        except Exception as e:
+            if 'packed_actions' not in str(e):
+                raise
+            _packed_supported = False
+    try:
+        server.multiple_actions(commands)
+    except Exception as e:
+        # Older servers have no multiple_actions; fall back to replaying
+        # the calls one at a time. Any other failure may have happened
+        # part way through, so replaying would duplicate keystrokes.
+        if 'multiple_actions' not in str(e):
+            raise
+        for command in commands:
+            _dispatch_one(server, command)
+
+
+def _dispatch_one(server, command):
+    name, args, kwargs = command
+    getattr(server, name)(*args, **kwargs)
+
+
+def execute(actions, data=None, pipelined=False):
+    '''Execute actions in order, sending all their proxy calls in one batch.
+       If pipelined and a pipeline is running, return without waiting for
+       the batch to be sent.'''
+    aenea_grammars.instrument.count_actions(len(actions))
+    pipeline = aenea_grammars.pipeline.current() if pipelined else None
+    with Batch(pipeline):
+        for action in actions:
+            action.execute(data)
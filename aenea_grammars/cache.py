@@ -0,0 +1,163 @@
+# On-disk cache of the tables a grammar module builds at import time.
+#
+# Entries are keyed on a hash of the contents of everything that can change
+# them: the module's own source and the grammar_config files it reads. On
+# disk only plain data is cached, the merged and validated spoken forms of
+# each command table, so a warm start neither parses nor checks the
+# configuration. The finished tables, actions and all, are also kept in
+# memory, so rebuilding a grammar whose files are unchanged (or, for git,
+# whose other tables changed) reuses them.
+#
+# A file is only read and hashed again when its stat stamp (modification
+# time and size) differs from the one it had when last hashed, which is
+# stored with the cache, so a warm start costs a stat call per file. A file
+# which was modified within RACY_SECONDS of being hashed is hashed again
+# regardless, since an edit of the same size within the file system's
+# timestamp resolution leaves the stamp unchanged.
+
+import cPickle
+import hashlib
+import os
+import time
+
+import aenea.config
+import aenea.configuration
+
+CACHE_VERSION = 4
+
+RACY_SECONDS = 2
+
+# cache file path -> (fingerprint, entries) for every cache read or written.
+_loaded = {}
+
+# path -> (mtime, size, time hashed, digest) for every file hashed.
+_digests = {}
+
+# (cache file path, table name, config key) -> (fingerprint, defaults, table)
+_tables = {}
+
+
+def _project_path(*components):
+    return os.path.join(aenea.config.PROJECT_ROOT, *components)
+
+
+def cache_path(filename):
+    '''Where a cache file called filename lives.'''
+    return _project_path('grammar_cache', filename)
+
+
+def write_atomically(path, data):
+    '''Replace the file at path with data, so that readers never see a
+       partly written file. Failure is reported but not raised: a cache
+       that can't be written just stays cold.'''
+    directory = os.path.dirname(path)
+    temporary = path + '.tmp'
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(temporary, 'wb') as fd:
+            fd.write(data)
+        if os.path.exists(path):
+            # Windows can't rename over an existing file.
+            os.remove(path)
+        os.rename(temporary, path)
+    except (IOError, OSError) as e:
+        print 'Unable to write grammar cache %s: %s' % (path, e)
+
+
+def _digest(path):
+    '''The SHA-1 of the file at path, or None if it can't be read.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    known = _digests.get(path)
+    if (known is not None and known[:2] == (stat.st_mtime, stat.st_size) and
+            known[2] - stat.st_mtime > RACY_SECONDS):
+        return known[3]
+    hashed = time.time()
+    try:
+        with open(path, 'rb') as fd:
+            digest = hashlib.sha1(fd.read()).hexdigest()
+    except IOError:
+        return None
+    _digests[path] = (stat.st_mtime, stat.st_size, hashed, digest)
+    return digest
+
+
+def fingerprint(paths):
+    digest = hashlib.sha1(str(CACHE_VERSION))
+    for path in paths:
+        digest.update('%s\0%s\0' % (path, _digest(path)))
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    def __init__(self, name, module_file, configs=()):
+        if module_file.endswith(('.pyc', '.pyo')):
+            module_file = module_file[:-1]
+        sources = [module_file]
+        sources.extend(_project_path('grammar_config', '%s.json' % config)
+                       for config in configs)
+        self.path = cache_path('%s.pickle' % name)
+        self._sources = sources
+        stored = None
+        if self.path not in _loaded:
+            stored = self._read()
+        self.fingerprint = fingerprint(sources)
+        self._entries = self._load(stored)
+
+    def _read(self):
+        '''(fingerprint, entries) from the cache file, or None. The digests
+           stored with it are remembered, so that unchanged sources need not
+           be hashed again.'''
+        try:
+            with open(self.path, 'rb') as fd:
+                stored_fingerprint, digests, entries = cPickle.load(fd)
+        except Exception:
+            return None
+        for (path, digest) in digests.iteritems():
+            _digests.setdefault(path, digest)
+        return (stored_fingerprint, entries)
+
+    def _load(self, stored):
+        if stored is None:
+            stored = _loaded.get(self.path)
+        if stored is None or stored[0] != self.fingerprint:
+            return {}
+        _loaded[self.path] = stored
+        return stored[1]
+
+    def _save(self):
+        _loaded[self.path] = (self.fingerprint, self._entries)
+        digests = dict((path, _digests[path]) for path in self._sources
+                       if path in _digests)
+        write_atomically(self.path, cPickle.dumps(
+            (self.fingerprint, digests, self._entries), 2))
+
+    def get(self, key, build):
+        '''Return the cached value for key, calling build() on a miss. The
+           value must be picklable plain data.'''
+        if key not in self._entries:
+            self._entries[key] = build()
+            self._save()
+        return self._entries[key]
+
+    def grammar_commands(self, name, defaults, config_key='commands'):
+        '''Cached equivalent of aenea.configuration.make_grammar_commands.
+           The table returned is shared, and must not be changed.'''
+        key = (self.path, name, config_key)
+        known = _tables.get(key)
+        if (known is not None and known[0] == self.fingerprint and
+                known[1] is defaults):
+            return known[2]
+
+        def build():
+            identity = dict((spoken, spoken) for spoken in defaults)
+            return aenea.configuration.make_grammar_commands(
+                name, identity, config_key=config_key)
+        spoken_forms = self.get(('commands', name, config_key), build)
+        table = dict((spoken, defaults[default])
+                     for (spoken, default) in spoken_forms.iteritems())
+        _tables[key] = (self.fingerprint, defaults, table)
+        return table
@@ -0,0 +1,254 @@
+# Proxy contexts sharing one snapshot of the remote window per utterance.
+#
+# At the start of every utterance dragonfly asks each grammar whether its
+# context matches, and every ProxyAppContext asks the Aenea server for the
+# foreground window again. The contexts here share a snapshot instead: the
+# server is queried at most once per utterance, and each context matches its
+# (precompiled) patterns against a snapshot once, remembering the result.
+#
+# A snapshot is reused while the local foreground window is unchanged, for at
+# most CONTEXT_TTL seconds, which is long enough to cover every grammar's
+# check at the start of one utterance and short enough that a focus change
+# on the remote side is picked up by the next. Call invalidate() when focus
+# is known to have changed.
+#
+# Servers that push focus changes make even that one query unnecessary.
+# While subscribe() is in effect a background thread keeps a long-poll
+# watch_context request open; the server answers it as soon as the remote
+# foreground window changes, or after WATCH_TIMEOUT seconds regardless, and
+# snapshots are then made from the latest answer without a round trip. With
+# a server that does not support it, or while it is unreachable, contexts
+# fall back to querying the server as above.
+
+import re
+import threading
+import time
+
+import aenea.communications
+import aenea.config
+
+from dragonfly import Context
+
+# Seconds a snapshot of the remote window stays valid.
+CONTEXT_TTL = 0.25
+
+# Seconds the server may hold a watch_context request open, and seconds to
+# wait before subscribing again after the server refused or failed.
+WATCH_TIMEOUT = 10
+RETRY_INTERVAL = 30
+
+
+class Snapshot(object):
+    '''What the server reported while one local window had focus. Each
+       query is only made the first time it is needed, unless the answers
+       were pushed (serial, context, server_info) beforehand.'''
+
+    def __init__(self, window, pushed=None):
+        self.window = window
+        self.taken = time.time()
+        self.serial = None
+        self._context = None
+        self._server_info = None
+        if pushed is not None:
+            self.serial, self._context, self._server_info = pushed
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = aenea.communications.server.get_context()
+        return self._context
+
+    @property
+    def server_info(self):
+        if self._server_info is None:
+            self._server_info = aenea.communications.server.server_info()
+        return self._server_info
+
+
+_snapshot = None
+
+
+def snapshot(executable, title, handle):
+    '''The current Snapshot for this local foreground window.'''
+    global _snapshot
+    window = (executable, title, handle)
+    pushed = _subscription.current() if _subscription is not None else None
+    if pushed is not None:
+        # Pushed contexts are current until the next push, whatever the
+        # local window.
+        if _snapshot is None or _snapshot.serial != pushed[0]:
+            _snapshot = Snapshot(window, pushed)
+        return _snapshot
+    if (_snapshot is None or _snapshot.serial is not None or
+            _snapshot.window != window or
+            time.time() - _snapshot.taken > CONTEXT_TTL):
+        _snapshot = Snapshot(window)
+    return _snapshot
+
+
+def latest_context():
+    '''The remote window's context from the current snapshot, or from the
+       server if there is none.'''
+    if _snapshot is not None:
+        return _snapshot.context
+    return aenea.communications.server.get_context()
+
+
+def invalidate():
+    '''Forget the current snapshot, so the next check queries the server.'''
+    global _snapshot
+    _snapshot = None
+
+
+def _connect():
+    # A connection of its own, as requests from different threads must not
+    # share one, with a timeout that outlasts a watch.
+    return aenea.communications.Proxy(aenea.config.HOST, aenea.config.PORT,
+                                      socket_timeout=WATCH_TIMEOUT + 5)
+
+
+class Subscription(object):
+    '''Follows the context pushed by the server on a background thread.
+       connect() returns a new connection to the server.'''
+
+    def __init__(self, connect=_connect):
+        self._connect = connect
+        # (serial, context, server_info, time received), replaced whole.
+        self._latest = None
+        self._failed = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def current(self):
+        '''(serial, context, server_info) as last pushed, or None if
+           there is no live subscription.'''
+        latest = self._latest
+        # A live server answers at least every WATCH_TIMEOUT seconds.
+        if latest is None or time.time() - latest[3] > 2 * WATCH_TIMEOUT:
+            return None
+        return latest[:3]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._watch()
+            except Exception as e:
+                self._latest = None
+                if not self._failed:
+                    print 'Context push unavailable, polling instead: %s' % e
+                    self._failed = True
+                self._stopped.wait(RETRY_INTERVAL)
+
+    def _watch(self):
+        server = self._connect()
+        server_info = server.server_info()
+        serial = None
+        while not self._stopped.is_set():
+            pushed = server.watch_context(serial, WATCH_TIMEOUT)
+            serial = pushed['serial']
+            self._latest = (serial, pushed['context'], server_info, time.time())
+            if self._failed:
+                print 'Context push available again.'
+                self._failed = False
+
+    def stop(self, timeout=None):
+        '''Stop following the server. The thread exits once its current
+           watch returns; given a timeout, wait that long for it.'''
+        self._stopped.set()
+        self._latest = None
+        if timeout is not None:
+            self._thread.join(timeout)
+
+
+_subscription = None
+_subscribers = 0
+
+
+def subscribe(connect=None):
+    '''Follow pushed context changes until the matching unsubscribe().
+       Calls nest, sharing one Subscription, which is returned.'''
+    global _subscription, _subscribers
+    _subscribers += 1
+    if _subscription is None:
+        _subscription = Subscription(connect or _connect)
+    return _subscription
+
+
+def unsubscribe(timeout=None):
+    global _subscription, _subscribers
+    _subscribers -= 1
+    if _subscribers == 0 and _subscription is not None:
+        _subscription.stop(timeout)
+        _subscription = None
+
+
+class _SnapshotContext(Context):
+    def __init__(self):
+        Context.__init__(self)
+        self._last = (None, False)
+
+    def matches(self, executable, title, handle):
+        if not aenea.config.proxy_active():
+            return False
+        current = snapshot(executable, title, handle)
+        if self._last[0] is not current:
+            self._last = (current, self._matches_snapshot(current))
+        return self._last[1]
+
+    def _matches_snapshot(self, snapshot):
+        raise NotImplementedError
+
+
+class ProxyAppContext(_SnapshotContext):
+    '''Drop-in for aenea's ProxyAppContext, matching against the shared
+       snapshot with patterns prepared up front.'''
+
+    def __init__(self, cls=None, cls_name=None, executable=None, title=None,
+                 match='substring', logic='and', case_sensitive=False,
+                 query=True):
+        _SnapshotContext.__init__(self)
+        assert match in ('substring', 'exact', 'regex')
+        assert logic in ('and', 'or')
+        self.match = match
+        self.logic = logic
+        self.case_sensitive = case_sensitive
+        self.arguments = dict((key, value) for (key, value) in (
+            ('cls', cls),
+            ('cls_name', cls_name),
+            ('executable', executable),
+            ('title', title)) if value is not None)
+        self._tests = [(key, self._compile(expected))
+                       for (key, expected) in sorted(self.arguments.iteritems())]
+
+    def _compile(self, expected):
+        if self.match == 'regex':
+            pattern = re.compile(expected)
+            return lambda actual: pattern.match(actual) is not None
+        if not self.case_sensitive:
+            expected = expected.lower()
+        if self.match == 'exact':
+            test = lambda actual: actual == expected
+        else:
+            test = lambda actual: expected in actual
+        if self.case_sensitive:
+            return test
+        return lambda actual: test(actual.lower())
+
+    def _matches_snapshot(self, snapshot):
+        context = snapshot.context
+        combine = any if self.logic == 'or' else all
+        return combine(test(context.get(key, ''))
+                       for (key, test) in self._tests)
+
+
+class ProxyPlatformContext(_SnapshotContext):
+    '''Drop-in for aenea's ProxyPlatformContext using the shared snapshot.'''
+
+    def __init__(self, platform):
+        _SnapshotContext.__init__(self)
+        self.platform = platform
+
+    def _matches_snapshot(self, snapshot):
+        return snapshot.server_info.get('platform') == self.platform
@@ -0,0 +1,32 @@
+# Declarative access to the named extras inside a recognition.
+#
+# Rather than indexing into node.children along paths that depend on exactly
+# how a spec was parsed, a rule names the extras it needs and an Extractor
+# finds all of them in one traversal of the recognition.
+
+
+class Extractor(object):
+    '''Finds the named extras below a node. As with dragonfly's shallow
+       get_child_by_name, named nodes are not searched inside, so the extras
+       of nested rules or named alternatives are never picked up by mistake.
+       Extras that weren't spoken are absent from the result.'''
+
+    def __init__(self, *names):
+        self.names = frozenset(names)
+
+    def nodes(self, node):
+        found = {}
+        stack = node.children[::-1]
+        while stack and len(found) < len(self.names):
+            child = stack.pop()
+            name = child.name
+            if name:
+                if name in self.names and name not in found:
+                    found[name] = child
+                continue
+            stack.extend(child.children[::-1])
+        return found
+
+    def __call__(self, node):
+        return dict((name, child.value())
+                    for (name, child) in self.nodes(node).iteritems())
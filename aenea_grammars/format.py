@@ -0,0 +1,77 @@
+# Identifier and prose formatters shared by the multiedit and vim grammars.
+#
+# A style is described by how its first word and its later words are
+# transformed and what separates them. FORMATTERS maps each spoken style to
+# its formatter, a function of the list of (cleaned) dictated words.
+
+# Spoken formatting styles, in the order they appear in grammar specs.
+FORMAT_STYLES = ('proper', 'camel', 'rel-path', 'abs-path', 'score', 'sentence',
+                 'scope-resolve', 'jumble', 'dotword', 'dashword', 'natword',
+                 'snakeword', 'brooding-narrative')
+
+
+def _same(word):
+    return word
+
+
+def _capitalize(word):
+    return word.capitalize()
+
+
+def _initial_upper(word):
+    return word[:1].upper() + word[1:]
+
+
+def _absolute(word):
+    return '/' + word
+
+
+def _nothing(word):
+    return ''
+
+
+# Dictated words have any engine annotation after a backslash and any hyphens
+# removed, then their case set according to the optional spoken prefix.
+def clean_word_lower(word):
+    return word.split('\\', 1)[0].replace('-', '').lower()
+
+
+def clean_word_upper(word):
+    return word.split('\\', 1)[0].replace('-', '').upper()
+
+
+def clean_word_natural(word):
+    return word.split('\\', 1)[0].replace('-', '')
+
+WORD_CLEANERS = {
+    'upper': clean_word_upper,
+    'natural': clean_word_natural,
+    }
+
+
+def _formatter(first, rest, separator, empty=''):
+    '''A function formatting a list of words: first transforms the first
+       word, rest the others, and separator goes between them.'''
+    def format(words):
+        if not words:
+            return empty
+        return separator.join([first(words[0])] + [rest(word) for word in words[1:]])
+    return format
+
+format_proper = _formatter(_capitalize, _capitalize, '')
+format_camel = _formatter(_same, _initial_upper, '')
+format_relpath = _formatter(_same, _same, '/')
+format_abspath = _formatter(_absolute, _same, '/', '/')
+format_score = _formatter(_same, _same, '_')
+format_sentence = _formatter(_capitalize, _same, ' ')
+format_scoperesolve = _formatter(_same, _same, '::')
+format_jumble = _formatter(_same, _same, '')
+format_dotword = _formatter(_same, _same, '.')
+format_dashword = _formatter(_same, _same, '-')
+format_natword = _formatter(_same, _same, ' ')
+format_snakeword = _formatter(_initial_upper, _same, '_')
+format_broodingnarrative = _formatter(_nothing, _nothing, '')
+
+# Each spoken style resolved to its formatter once, at load time.
+FORMATTERS = dict((style, globals()['format_%s' % style.replace('-', '')])
+                  for style in FORMAT_STYLES)
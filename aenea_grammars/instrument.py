@@ -0,0 +1,239 @@
+# Opt-in latency instrumentation for grammar rules.
+#
+# Enabled by PROJECT_ROOT/grammar_config/instrument.json (see
+# instrument.json.example); when it is off, instrumented returns rule classes
+# untouched and costs nothing. When on, every recognition of an instrumented
+# top-level rule is timed in three phases:
+#
+#   value     time spent in the value() methods of instrumented rules,
+#             which build the actions from the parse tree
+#   execute   the rest of process_recognition, executing the actions
+#   dispatch  the part of execute spent waiting on the Aenea server
+#
+# along with the number of actions executed and of calls made to the server.
+# Batches handed to an aenea_grammars.pipeline are sent after the rule has
+# returned; their calls and time still count towards the recognition that
+# submitted them, but that dispatch time is not part of execute or total,
+# and only appears once the pipeline has sent the batch.
+#
+# The engine's own parse happens before any grammar code runs, so it isn't
+# visible from here; harness/replay.py reports it for recorded utterances.
+# The last few recognitions are kept for histograms, and can be dumped to a
+# JSON file.
+
+import collections
+import json
+import time
+
+import aenea.communications
+import aenea.configuration
+
+PHASES = ('value', 'execute', 'dispatch', 'total')
+
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_DEFAULT_CONFIG = {
+    'enabled': False,
+    'window': 1000,
+    'dump_file': None,
+    'dump_every': 0,
+    }
+
+
+class Recognition(object):
+    '''Timings and counts for one recognition.'''
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.started = time.time()
+        self.value = 0.0
+        self.execute = 0.0
+        self.dispatch = 0.0
+        self.total = 0.0
+        self.values = {}      # rule name -> seconds in its value()
+        self.actions = None
+        self.dispatches = 0
+
+    def as_dict(self):
+        return {
+            'rule': self.rule,
+            'started': self.started,
+            'value': self.value,
+            'execute': self.execute,
+            'dispatch': self.dispatch,
+            'total': self.total,
+            'values': self.values,
+            'actions': self.actions,
+            'dispatches': self.dispatches,
+            }
+
+
+class History(object):
+    '''The most recent recognitions, with histograms over them.'''
+
+    def __init__(self, window):
+        self.recognitions = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, recognition):
+        self.recognitions.append(recognition)
+        self.count += 1
+
+    def histogram(self, phase):
+        '''Returns {rule: [count per bucket]}, with one extra bucket for
+           anything slower than the last bound.'''
+        histograms = {}
+        for recognition in self.recognitions:
+            counts = histograms.setdefault(
+                recognition.rule, [0] * (len(BUCKETS) + 1))
+            milliseconds = getattr(recognition, phase) * 1000
+            bucket = 0
+            while bucket < len(BUCKETS) and milliseconds > BUCKETS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return histograms
+
+    def dump(self, path):
+        with open(path, 'w') as fd:
+            json.dump({
+                'buckets': BUCKETS,
+                'histograms': dict((phase, self.histogram(phase))
+                                   for phase in PHASES),
+                'recognitions': [recognition.as_dict()
+                                 for recognition in self.recognitions],
+                }, fd, indent=1, sort_keys=True)
+
+
+class CountingServer(object):
+    '''Wraps the Aenea server to count and time the calls made through it
+       towards recognition.'''
+
+    def __init__(self, recognition, server):
+        self._recognition = recognition
+        self._server = server
+
+    def __getattr__(self, name):
+        call = getattr(self._server, name)
+
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                self._recognition.dispatch += time.time() - started
+                self._recognition.dispatches += 1
+        return timed
+
+
+_config = None
+_history = None
+_current = None
+_value_depth = 0
+
+
+def _load_config():
+    global _config, _history
+    if _config is None:
+        _config = dict(_DEFAULT_CONFIG)
+        _config.update(aenea.configuration.ConfigWatcher(
+            ('grammar_config', 'instrument'), _DEFAULT_CONFIG).conf)
+        _history = History(_config['window'])
+    return _config
+
+
+def enabled():
+    return bool(_load_config()['enabled'])
+
+
+def history():
+    '''The History of recent recognitions, or None if disabled.'''
+    return _history if enabled() else None
+
+
+def dump(path=None):
+    '''Write the recent recognitions and their histograms to path, by default
+       the configured dump_file.'''
+    path = path or _load_config()['dump_file']
+    if path and enabled():
+        _history.dump(path)
+
+
+def current():
+    '''The Recognition being processed, or None.'''
+    return _current
+
+
+def count_actions(count):
+    '''Called by code which executes a list of actions itself, such as
+       aenea_grammars.batch.execute.'''
+    if _current is not None:
+        _current.actions = (_current.actions or 0) + count
+
+
+def _finish(recognition):
+    recognition.execute = recognition.total - recognition.value
+    if recognition.actions is None:
+        # The rule ran its single bound action, as MappingRule does.
+        recognition.actions = 1
+    _history.add(recognition)
+    every = _config['dump_every']
+    if every and _history.count % every == 0:
+        try:
+            dump()
+        except (IOError, OSError) as e:
+            print 'Unable to write instrumentation dump: %s' % e
+
+
+def _wrap_process_recognition(method):
+    def process_recognition(self, node):
+        global _current
+        if _current is not None:
+            return method(self, node)
+        recognition = _current = Recognition(self.name)
+        server = aenea.communications.server
+        aenea.communications.server = CountingServer(recognition, server)
+        started = time.time()
+        try:
+            return method(self, node)
+        finally:
+            recognition.total = time.time() - started
+            aenea.communications.server = server
+            _current = None
+            _finish(recognition)
+    process_recognition._instrumented = True
+    return process_recognition
+
+
+def _wrap_value(method):
+    def value(self, node):
+        global _value_depth
+        if _current is None:
+            return method(self, node)
+        _value_depth += 1
+        started = time.time()
+        try:
+            return method(self, node)
+        finally:
+            elapsed = time.time() - started
+            _value_depth -= 1
+            name = type(self).__name__
+            _current.values[name] = _current.values.get(name, 0.0) + elapsed
+            if not _value_depth:
+                _current.value += elapsed
+    value._instrumented = True
+    return value
+
+
+def instrumented(rule_class):
+    '''Class decorator timing a rule's value and process_recognition. Only
+       the outermost instrumented rule of a recognition records it, so it is
+       safe to decorate both a top-level rule and the rules it refers to.'''
+    if not enabled():
+        return rule_class
+    for (name, wrap) in (('value', _wrap_value),
+                         ('process_recognition', _wrap_process_recognition)):
+        method = getattr(rule_class, name).im_func
+        if not getattr(method, '_instrumented', False):
+            setattr(rule_class, name, wrap(method))
+    return rule_class
@@ -0,0 +1,101 @@
+# Deferred loading for context-gated grammars.
+#
+# A LazyGrammar registers only a tiny probe grammar with the engine. The probe
+# sees every utterance start (_process_begin) and, the first time the real
+# grammar's context matches, the rules are added to the real grammar and it
+# is loaded. Engine-side compilation therefore only happens for applications
+# that are actually used. Optionally the real grammar is unloaded again once
+# its context hasn't matched for idle_unload seconds.
+
+import time
+
+from dragonfly import (
+    CompoundRule,
+    Grammar
+    )
+
+
+class _ProbeRule(CompoundRule):
+    # Never active; a grammar needs at least one rule to be loaded.
+    spec = 'aenea grammars lazy probe'
+    exported = True
+
+
+class _ProbeGrammar(Grammar):
+    def __init__(self, name, owner):
+        self._owner = owner
+        Grammar.__init__(self, name)
+
+    def _process_begin(self, executable, title, handle):
+        self._owner._probe(executable, title, handle)
+
+
+class LazyGrammar(object):
+    '''Stands in for a Grammar whose rules are built by build(grammar) on
+       first use. build must add rules to the grammar it is passed, but not
+       load it.'''
+
+    def __init__(self, name, context, build, idle_unload=None):
+        self.name = name
+        self.context = context
+        self.idle_unload = idle_unload
+        self._build = build
+        self._grammar = None
+        self._last_match = None
+        self._probe_grammar = _ProbeGrammar('%s probe' % name, self)
+        probe_rule = _ProbeRule(name='%s probe' % name)
+        self._probe_grammar.add_rule(probe_rule)
+        probe_rule.disable()
+
+    @property
+    def grammar(self):
+        '''The real grammar, or None if it hasn't been needed yet.'''
+        return self._grammar
+
+    def load(self):
+        self._probe_grammar.load()
+
+    def unload(self):
+        self._unload_rules()
+        self._probe_grammar.unload()
+
+    def build(self):
+        '''A new, unloaded grammar holding the real rules.'''
+        grammar = Grammar(self.name, context=self.context)
+        self._build(grammar)
+        return grammar
+
+    def _load_rules(self, executable, title, handle):
+        grammar = self.build()
+        grammar.load()
+        # The engine has already started this utterance, so activate the
+        # new rules by hand rather than waiting for the next one.
+        grammar.process_begin(executable, title, handle)
+        self._grammar = grammar
+
+    def replace(self, grammar):
+        '''Swap a rebuilt grammar in for the real one. Until the real one has
+           been needed there is nothing to replace; it will be built from
+           the current configuration when it is.'''
+        if self._grammar is not None:
+            self._grammar.unload()
+            grammar.load()
+            self._grammar = grammar
+
+    def _unload_rules(self):
+        if self._grammar is not None:
+            self._grammar.unload()
+            self._grammar = None
+
+    def _probe(self, executable, title, handle):
+        if self._grammar is not None and self.idle_unload is None:
+            # Loaded for good; the real grammar checks its own context.
+            return
+        now = time.time()
+        if self.context.matches(executable, title, handle):
+            self._last_match = now
+            if self._grammar is None:
+                self._load_rules(executable, title, handle)
+        elif (self._grammar is not None and self.idle_unload is not None and
+                now - self._last_match > self.idle_unload):
+            self._unload_rules()
@@ -0,0 +1,107 @@
+# Pasting long dictated text instead of typing it.
+#
+# Text actions are typed on the remote side a character at a time, so a long
+# dictated sentence or identifier takes a while to appear. When enabled by
+# PROJECT_ROOT/grammar_config/paste.json (see paste.json.example), BulkText
+# delivers text of at least `threshold` characters through the clipboard
+# instead: the remote clipboard is saved, set to the text, the grammar's
+# paste key is pressed, and the clipboard is restored once the application
+# has had restore_delay milliseconds to read it. A BulkText multiplied by a
+# count pastes that many times between saving and restoring the clipboard.
+#
+# Short text is still typed, as is text for windows whose executable, class
+# or title contains an entry of the deny list (terminals paste with other
+# keys, and some applications treat pasted text differently), text executed
+# locally rather than through the proxy, and text sent to servers without
+# get_clipboard and set_clipboard.
+
+import aenea
+import aenea.communications
+import aenea.config
+import aenea.configuration
+
+import aenea_grammars.actions
+import aenea_grammars.context
+
+from dragonfly import ActionBase
+
+_DEFAULT_CONFIG = {
+    'enabled': False,
+    'threshold': 40,
+    'restore_delay': 100,
+    'deny': ['term', 'konsole', 'xterm', 'urxvt'],
+    # Keys to paste with in each grammar's windows, overriding its default.
+    'paste_keys': {},
+    }
+
+_config = None
+
+# Cleared once the server turns out to have no clipboard calls.
+_clipboard_supported = True
+
+
+def _load_config():
+    global _config
+    if _config is None:
+        _config = dict(_DEFAULT_CONFIG)
+        _config.update(aenea.configuration.ConfigWatcher(
+            ('grammar_config', 'paste'), _DEFAULT_CONFIG).conf)
+        _config['deny'] = [entry.lower() for entry in _config['deny']]
+    return _config
+
+
+def _denied(deny):
+    context = aenea_grammars.context.latest_context()
+    window = ' '.join(context.get(key, '') for key in
+                      ('executable', 'cls', 'cls_name', 'title')).lower()
+    return any(entry in window for entry in deny)
+
+
+class BulkText(ActionBase):
+    '''Types text count times like Text, or pastes it with paste_key when it
+       is long enough. grammar names the grammar whose paste key can be
+       configured.'''
+
+    def __init__(self, text, grammar, paste_key='c-v', count=1):
+        ActionBase.__init__(self)
+        self.text = text
+        self.grammar = grammar
+        self.paste_key = paste_key
+        self.count = count
+
+    def __mul__(self, factor):
+        if not isinstance(factor, (int, long)):
+            return ActionBase.__mul__(self, factor)
+        return BulkText(self.text, self.grammar, self.paste_key,
+                        self.count * factor)
+
+    def typed(self):
+        '''A Text action typing this, never pasting.'''
+        return aenea.Text(self.text * self.count)
+
+    def _execute(self, data=None):
+        if not self._paste():
+            self.typed().execute(data)
+
+    def _paste(self):
+        '''Paste the text if that's allowed; returns whether it was.'''
+        global _clipboard_supported
+        config = _load_config()
+        if (not config['enabled'] or not _clipboard_supported or
+                len(self.text) < config['threshold'] or
+                not aenea.config.proxy_active() or _denied(config['deny'])):
+            return False
+        server = aenea.communications.server
+        try:
+            saved = server.get_clipboard()
+        except Exception as e:
+            if 'get_clipboard' not in str(e):
+                raise
+            _clipboard_supported = False
+            return False
+        server.set_clipboard(self.text)
+        paste_key = config['paste_keys'].get(self.grammar, self.paste_key)
+        (aenea_grammars.actions.Key(paste_key) * self.count).execute()
+        server.pause(config['restore_delay'])
+        server.set_clipboard(saved)
+        return True
@@ -0,0 +1,144 @@
+# Pipelined sending of batched actions over the Aenea proxy.
+#
+# Executing a long chained utterance blocks the engine until the server has
+# typed every keystroke. A Pipeline takes batches of commands (see
+# aenea_grammars.batch) from the engine thread and sends them from a thread
+# of its own, in the order they were submitted, so the rule returns as soon
+# as its actions are recorded and the engine can go on to the next utterance.
+# At most WINDOW batches wait to be sent; submitting more blocks until one
+# has gone.
+#
+# Everything else must not overtake what is still queued, nor share the
+# connection with the sender. While a pipeline runs, aenea.communications.
+# server is wrapped so that any call made through it first waits for the
+# queue to drain (barrier()). That covers context queries as well as
+# unpipelined batches. Actions that execute locally, without the proxy, do
+# not go through the server and are not ordered against queued batches.
+#
+# Each batch carries the aenea_grammars.instrument recognition that submitted
+# it, if any, and its calls are counted towards that recognition when sent.
+
+import Queue
+import threading
+import traceback
+
+import aenea.communications
+
+import aenea_grammars.batch
+import aenea_grammars.instrument
+
+# Batches submitted but not yet sent before submit() blocks.
+WINDOW = 8
+
+
+class _OrderedServer(object):
+    '''Wraps the Aenea server so that calls wait for the pipeline first.'''
+
+    def __init__(self, pipeline, server):
+        self._pipeline = pipeline
+        self._server = server
+
+    def __getattr__(self, name):
+        call = getattr(self._server, name)
+
+        def ordered(*args, **kwargs):
+            self._pipeline.barrier()
+            return call(*args, **kwargs)
+        return ordered
+
+
+class Pipeline(object):
+    '''Sends submitted batches to server, one at a time and in order, from a
+       background thread.'''
+
+    def __init__(self, server, window=WINDOW):
+        self.server = server
+        self._queue = Queue.Queue(window)
+        self._pending = 0
+        self._drained = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, commands):
+        with self._drained:
+            self._pending += 1
+        self._queue.put((commands, aenea_grammars.instrument.current()))
+
+    def barrier(self, timeout=None):
+        '''Wait until everything submitted so far has been sent. Returns
+           False if it had not been after timeout seconds.'''
+        with self._drained:
+            if self._pending and threading.current_thread() is self._thread:
+                raise RuntimeError('barrier() called by the pipeline itself')
+            if timeout is None:
+                while self._pending:
+                    self._drained.wait()
+            elif self._pending:
+                self._drained.wait(timeout)
+            return not self._pending
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            commands, recognition = batch
+            server = self.server
+            if recognition is not None:
+                server = aenea_grammars.instrument.CountingServer(recognition,
+                                                                  server)
+            try:
+                aenea_grammars.batch.send(server, commands)
+            except Exception:
+                # The engine has moved on, so the error can only be reported.
+                # Later batches belong to later utterances and still go out.
+                print 'Unable to send pipelined actions:'
+                traceback.print_exc()
+            finally:
+                with self._drained:
+                    self._pending -= 1
+                    self._drained.notify_all()
+
+    def stop(self):
+        '''Send what is queued, then stop the thread.'''
+        self._queue.put(None)
+        self._thread.join()
+
+
+_pipeline = None
+_users = 0
+
+
+def start():
+    '''Start the shared pipeline, if it is not running already. Calls nest
+       with stop().'''
+    global _pipeline, _users
+    _users += 1
+    if _pipeline is None:
+        _pipeline = Pipeline(aenea.communications.server)
+        aenea.communications.server = _OrderedServer(_pipeline,
+                                                     _pipeline.server)
+    return _pipeline
+
+
+def stop():
+    global _pipeline, _users
+    _users -= 1
+    if _users == 0 and _pipeline is not None:
+        pipeline, _pipeline = _pipeline, None
+        if isinstance(aenea.communications.server, _OrderedServer):
+            aenea.communications.server = pipeline.server
+        pipeline.stop()
+
+
+def current():
+    '''The running pipeline, or None.'''
+    return _pipeline
+
+
+def barrier(timeout=None):
+    '''Wait for the running pipeline, if any, to send what it was given.'''
+    if _pipeline is None:
+        return True
+    return _pipeline.barrier(timeout)
@@ -0,0 +1,142 @@
+# Hot reload of grammars when their configuration changes.
+#
+# A Reloader watches a grammar's files in grammar_config. When one changes,
+# the new rules are built on a background thread while recognition carries
+# on with the old ones. The finished grammar is swapped in from a dragonfly
+# timer, which runs on the engine thread between recognitions, so every
+# utterance is handled entirely by either the old rules or the new.
+#
+# Dragonfly binds rules and lists to the grammar they are first loaded in, so
+# a rebuild must create all of them afresh rather than reuse the old ones.
+
+import os
+import Queue
+import threading
+import traceback
+
+import aenea.config
+
+from dragonfly import (
+    Grammar,
+    Timer
+    )
+
+# How often, in seconds, to check the configuration files for changes.
+RELOAD_INTERVAL = 2
+
+
+class ReloadableGrammar(object):
+    '''A grammar whose rules are added by build(grammar), and which can be
+       replaced by a rebuilt copy. attach(grammar), if given, is called on
+       the engine thread just before a grammar is loaded, and release(grammar)
+       once it has been replaced or unloaded for good, or failed to build.'''
+
+    def __init__(self, name, build, context=None, attach=None, release=None):
+        self.name = name
+        self.context = context
+        self._build = build
+        self._attach = attach
+        self._release = release
+        self._grammar = None
+
+    @property
+    def grammar(self):
+        return self._grammar
+
+    def build(self):
+        '''A new, unloaded grammar holding the rules.'''
+        grammar = Grammar(self.name, context=self.context)
+        try:
+            self._build(grammar)
+        except Exception:
+            self.discard(grammar)
+            raise
+        return grammar
+
+    def _load(self, grammar):
+        if self._attach is not None:
+            self._attach(grammar)
+        grammar.load()
+        self._grammar = grammar
+
+    def load(self):
+        if self._grammar is None:
+            self._load(self.build())
+
+    def unload(self):
+        if self._grammar is not None:
+            self._grammar.unload()
+            self.discard(self._grammar)
+            self._grammar = None
+
+    def replace(self, grammar):
+        '''Swap grammar in for the loaded one. The old one is unloaded first
+           so that lists are never claimed by both at once.'''
+        if self._grammar is None:
+            self.discard(grammar)
+            return
+        self.unload()
+        self._load(grammar)
+
+    def discard(self, grammar):
+        if self._release is not None:
+            self._release(grammar)
+
+
+class Reloader(object):
+    '''Rebuilds target (a ReloadableGrammar or LazyGrammar) whenever one of
+       the named grammar_config files changes.'''
+
+    def __init__(self, configs, target, interval=RELOAD_INTERVAL):
+        self.paths = [os.path.join(aenea.config.PROJECT_ROOT, 'grammar_config',
+                                   '%s.json' % config) for config in configs]
+        self.target = target
+        self._stamps = self._read_stamps()
+        self._built = Queue.Queue()
+        self._building = False
+        self._timer = Timer(self.poll, interval)
+
+    def _read_stamps(self):
+        stamps = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def poll(self):
+        '''Swap in a finished build, or start one if the configuration has
+           changed. Must run on the engine thread.'''
+        try:
+            grammar = self._built.get_nowait()
+        except Queue.Empty:
+            pass
+        else:
+            self._building = False
+            if grammar is not None:
+                self.target.replace(grammar)
+        if self._building:
+            # Changes made meanwhile are picked up once this build is in.
+            return
+        stamps = self._read_stamps()
+        if stamps != self._stamps:
+            self._stamps = stamps
+            self._building = True
+            thread = threading.Thread(target=self._rebuild)
+            thread.daemon = True
+            thread.start()
+
+    def _rebuild(self):
+        grammar = None
+        try:
+            grammar = self.target.build()
+        except Exception:
+            # Most likely a bad edit; keep the old rules until the next one.
+            print 'Unable to rebuild grammar %s:' % self.target.name
+            traceback.print_exc()
+        self._built.put(grammar)
+
+    def stop(self):
+        self._timer.stop()
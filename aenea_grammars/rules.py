@@ -0,0 +1,120 @@
+# Rules and mappings shared between the grammars.
+#
+# Dragonfly compiles every rule into the one grammar it is loaded with, and
+# grammars are rebuilt from scratch when their configuration changes, so a
+# rule instance can't be shared between grammars. What is shared instead is
+# everything an instance is made from: the mappings and their actions are
+# built once here, and each grammar instantiates the rules it refers to.
+#
+# DigitalInteger elements are the exception: they are plain repetitions of a
+# digit rule that aenea already shares between all of them, so one element
+# per (name, min, max) is shared by every grammar that asks. IntegerRef is
+# not: it wraps a rule of its own, which belongs to the first grammar it is
+# added to, so every build gets a new one from integer_ref().
+
+import collections
+
+import aenea.misc
+
+import aenea_grammars.format
+import aenea_grammars.instrument
+import aenea_grammars.paste
+
+from aenea_grammars.actions import Text
+
+from dragonfly import (
+    CompoundRule,
+    Dictation,
+    IntegerRef,
+    Literal,
+    MappingRule,
+    Repetition,
+    RuleRef,
+    Sequence
+    )
+
+# DigitalInteger elements kept for reuse; the least recently used go first.
+INTEGER_CACHE_SIZE = 32
+
+_integers = collections.OrderedDict()
+
+
+def digital_integer(name, min, max):
+    '''A shared DigitalInteger element: a number spoken digit by digit, in
+       at least min and fewer than max digits.'''
+    key = (name, min, max)
+    element = _integers.pop(key, None)
+    if element is None:
+        element = aenea.misc.DigitalInteger(name, min, max)
+        if len(_integers) >= INTEGER_CACHE_SIZE:
+            _integers.popitem(last=False)
+    _integers[key] = element
+    return element
+
+
+def integer_ref(name, min, max):
+    '''A new IntegerRef element, for one grammar only.'''
+    return IntegerRef(name, min, max)
+
+
+# Built up front: the ranges the grammars in this repository use.
+PRELOADED_INTEGERS = [
+    ('count', 1, 3),
+    ('n', 1, None),
+    ]
+for arguments in PRELOADED_INTEGERS:
+    digital_integer(*arguments)
+
+# Spoken letters and digits to the text they type.
+LETTER_TEXT = dict((spoken, Text(letter))
+                   for (spoken, letter) in aenea.misc.LETTERS.iteritems())
+DIGIT_TEXT = dict((spoken, Text(digit))
+                  for (spoken, digit) in aenea.misc.DIGITS.iteritems())
+ALPHANUMERIC_TEXT = dict((spoken, Text(character))
+                         for (spoken, character) in aenea.misc.ALPHANUMERIC.iteritems())
+
+# Spoken letters and 'dig' digits to the characters themselves.
+SPELLING = dict(('dig ' + spoken, digit)
+                for (spoken, digit) in aenea.misc.DIGITS.iteritems())
+SPELLING.update(aenea.misc.LETTERS)
+
+
+class LetterMapping(MappingRule):
+    '''A spoken letter; its value is the letter.'''
+    mapping = aenea.misc.LETTERS
+
+
+@aenea_grammars.instrument.instrumented
+class FormatRule(CompoundRule):
+    '''Dictation in one of the format styles, typed (or pasted, see
+       aenea_grammars.paste) in grammar's windows.'''
+    spec = ('[upper | natural] ( %s ) [<dictation>]' %
+            ' | '.join(aenea_grammars.format.FORMAT_STYLES))
+    extras = [Dictation(name='dictation')]
+
+    def __init__(self, grammar, paste_key='c-v', *args, **kwargs):
+        CompoundRule.__init__(self, *args, **kwargs)
+        self.grammar = grammar
+        self.paste_key = paste_key
+
+    def value(self, node):
+        words = node.words()
+
+        clean = aenea_grammars.format.WORD_CLEANERS.get(words[0])
+        if clean is None:
+            clean = aenea_grammars.format.clean_word_lower
+        else:
+            del words[0]
+
+        function = aenea_grammars.format.FORMATTERS[words[0].lower()]
+        formatted = function([clean(word) for word in words[1:]])
+
+        return aenea_grammars.paste.BulkText(formatted, self.grammar,
+                                             self.paste_key)
+
+
+def spelled(literal, mapping, ref_name, rule_name, max=20):
+    '''literal followed by up to max - 1 entries of mapping.'''
+    return Sequence([Literal(literal), Repetition(
+        RuleRef(name=ref_name, rule=MappingRule(name=rule_name, mapping=mapping)),
+        min=1, max=max)])
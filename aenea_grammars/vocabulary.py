@@ -0,0 +1,338 @@
+# Vocabulary index with incremental reload.
+#
+# The files under PROJECT_ROOT/vocabulary_config/{static,dynamic} are indexed
+# as tag -> phrase -> action. Every few seconds the index stats the files;
+# only files which changed are re-read, and only the entries whose value
+# changed are pushed into the DictLists handed out by
+# register_dynamic_vocabulary and register_static_vocabulary, so that the
+# engine updates those lists rather than recompiling the grammars. Grammars
+# using this module should inhibit Aenea's global handling of their tags, as
+# multiedit and vim do.
+#
+# Refreshing runs from a dragonfly timer on the engine thread, so lists must
+# be registered and unregistered there too. A grammar built on another
+# thread (see aenea_grammars.reload) creates its lists empty and registers
+# them once it is swapped in.
+#
+# Phrases are compiled as they are read: alternatives such as
+# "abbreviate (authenticate|authentication)" are expanded into one plain
+# phrase each, so that they can be DictList keys, and the compiled entries
+# of every file are kept in grammar_cache so that a file is only parsed again
+# once it changes. Each distinct action spec is built into an action once and
+# shared by every phrase and tag using it.
+
+import json
+import marshal
+import os
+import re
+
+import aenea
+import aenea.config
+
+import aenea_grammars.actions
+import aenea_grammars.cache
+
+from dragonfly import (
+    DictList,
+    Timer
+    )
+
+# How often, in seconds, to check the vocabulary files for changes.
+REFRESH_INTERVAL = 2
+
+# Entry kinds in a vocabulary file and the action a plain string becomes.
+_ENTRY_KINDS = (
+    ('vocabulary', 'Text'),
+    ('shortcuts', 'Key'),
+    )
+
+# Bump when the compiled entry format changes.
+COMPILED_VERSION = 1
+
+_PHRASE_TOKEN = re.compile(r'[()\[\]|]|[^\s()\[\]|]+')
+
+
+def expand_phrase(phrase):
+    '''Expands the (a|b) alternatives and [optional] words of a spoken form
+       into the list of plain phrases it matches.'''
+    tokens = _PHRASE_TOKEN.findall(phrase)
+    position = [0]
+
+    def alternatives():
+        expansions = sequence()
+        while position[0] < len(tokens) and tokens[position[0]] == '|':
+            position[0] += 1
+            expansions.extend(sequence())
+        return expansions
+
+    def sequence():
+        expansions = [[]]
+        while (position[0] < len(tokens) and
+               tokens[position[0]] not in ('|', ')', ']')):
+            token = tokens[position[0]]
+            position[0] += 1
+            if token in ('(', '['):
+                choices = alternatives()
+                position[0] += 1
+                if token == '[':
+                    choices.append([])
+            else:
+                choices = [[token]]
+            expansions = [words + choice
+                          for words in expansions for choice in choices]
+        return expansions
+
+    phrases = []
+    for words in alternatives():
+        expanded = ' '.join(words)
+        if expanded and expanded not in phrases:
+            phrases.append(expanded)
+    return phrases
+
+
+def _action(action_type):
+    cls = getattr(aenea, action_type)
+    if cls in (aenea.Key, aenea.Text):
+        return aenea_grammars.actions.interned(cls)
+    return cls
+
+
+def build_action(value, default_type):
+    '''Aenea's vocabulary action format: a string for the default action
+       type, or a list of {"type": ..., "args": [...]} run in sequence.'''
+    if not isinstance(value, list):
+        return _action(default_type)(str(value))
+    actions = [_action(item['type'])(*item['args']) for item in value]
+    action = actions[0]
+    for other in actions[1:]:
+        action = action + other
+    return action
+
+
+_actions = {}
+
+
+def compiled_action(value, default_type):
+    '''build_action, but each distinct spec is only built once.'''
+    key = (default_type, json.dumps(value, sort_keys=True))
+    if key not in _actions:
+        _actions[key] = build_action(value, default_type)
+    return _actions[key]
+
+
+def read_vocabulary_file(path):
+    '''Returns {tag: {phrase: (default type, raw value)}} for one file, with
+       the alternatives in each phrase expanded.'''
+    with open(path) as fd:
+        contents = json.load(fd)
+    if isinstance(contents, dict):
+        contents = [contents]
+    entries = {}
+    for section in contents:
+        for (kind, default_type) in _ENTRY_KINDS:
+            for (spoken, value) in section.get(kind, {}).iteritems():
+                for phrase in expand_phrase(str(spoken)):
+                    for tag in section.get('tags', ()):
+                        entries.setdefault(str(tag), {})[phrase] = (
+                            default_type, value)
+    return entries
+
+
+def _load_compiled(path, root):
+    try:
+        with open(path, 'rb') as fd:
+            (version, compiled_root, files) = marshal.load(fd)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    if version != COMPILED_VERSION or compiled_root != root:
+        return {}
+    return files
+
+
+class VocabularyIndex(object):
+    '''Merged view of one vocabulary directory. Where files disagree about
+       a phrase the one whose name sorts last wins. With a compiled path,
+       the entries of unchanged files are loaded from there rather than
+       parsed.'''
+
+    def __init__(self, root, compiled=None):
+        self.root = root
+        self.compiled = compiled
+        self._precompiled = {}
+        if compiled is not None:
+            self._precompiled = _load_compiled(compiled, root)
+        self._files = {}    # path -> (stat stamp, entries)
+        self._merged = {}   # tag -> {phrase: ((type, raw value), action)}
+        self._lists = {}    # tag -> DictLists kept in sync with _merged
+
+    def _stamps(self):
+        stamps = {}
+        if not os.path.isdir(self.root):
+            return stamps
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                path = os.path.join(self.root, name)
+                stat = os.stat(path)
+                stamps[path] = (stat.st_mtime, stat.st_size)
+        return stamps
+
+    def refresh(self):
+        '''Re-read changed files and apply the entry-level differences.
+           Returns the set of tags whose vocabulary changed.'''
+        stamps = self._stamps()
+        changed = [path for path in set(stamps) | set(self._files)
+                   if path not in self._files or
+                   stamps.get(path) != self._files[path][0]]
+        if not changed:
+            return set()
+
+        affected = {}
+        for path in changed:
+            old = self._files.pop(path, (None, {}))[1]
+            new = {}
+            if path in stamps:
+                precompiled = self._precompiled.pop(path, None)
+                if precompiled is not None and precompiled[0] == stamps[path]:
+                    new = precompiled[1]
+                else:
+                    try:
+                        new = read_vocabulary_file(path)
+                    except (IOError, ValueError) as e:
+                        # Probably caught mid-edit; keep the old entries
+                        # until the file changes again.
+                        print 'Unable to read vocabulary %s: %s' % (path, e)
+                        new = old
+                self._files[path] = (stamps[path], new)
+            for tag in set(old) | set(new):
+                old_entries = old.get(tag, {})
+                new_entries = new.get(tag, {})
+                affected.setdefault(tag, set()).update(
+                    phrase for phrase in set(old_entries) | set(new_entries)
+                    if old_entries.get(phrase) != new_entries.get(phrase))
+
+        order = sorted(self._files)
+        changed_tags = set()
+        for (tag, phrases) in affected.iteritems():
+            merged = self._merged.setdefault(tag, {})
+            updates = {}
+            removals = []
+            for phrase in phrases:
+                winner = None
+                for path in order:
+                    winner = self._files[path][1].get(tag, {}).get(phrase, winner)
+                if winner is None:
+                    if phrase in merged:
+                        del merged[phrase]
+                        removals.append(phrase)
+                elif phrase not in merged or merged[phrase][0] != winner:
+                    action = compiled_action(winner[1], winner[0])
+                    merged[phrase] = (winner, action)
+                    updates[phrase] = action
+            if updates or removals:
+                changed_tags.add(tag)
+                self._push(tag, updates, removals)
+        self._precompiled = {}
+        self._save()
+        return changed_tags
+
+    def _save(self):
+        if self.compiled is not None:
+            aenea_grammars.cache.write_atomically(self.compiled, marshal.dumps(
+                (COMPILED_VERSION, self.root, self._files)))
+
+    def _push(self, tag, updates, removals):
+        for dict_list in self._lists.get(tag, ()):
+            for phrase in removals:
+                del dict_list[phrase]
+            if updates:
+                dict_list.update(updates)
+
+    def vocabulary(self, tag):
+        return dict((phrase, action) for (phrase, (raw, action))
+                    in self._merged.get(tag, {}).iteritems())
+
+    def register(self, tag, dict_list):
+        '''Fill dict_list with tag's vocabulary and keep it up to date. Each
+           grammar needs a list of its own, since dragonfly binds a list to
+           one grammar.'''
+        dict_list.update(self.vocabulary(tag))
+        self._lists.setdefault(tag, []).append(dict_list)
+        return dict_list
+
+    def unregister(self, tag, dict_list=None):
+        '''Stop updating dict_list, or every list for tag if it is None.'''
+        lists = [other for other in self._lists.pop(tag, [])
+                 if dict_list is not None and other is not dict_list]
+        if lists:
+            self._lists[tag] = lists
+
+    @property
+    def registered(self):
+        return bool(self._lists)
+
+
+_indexes = {}
+_timer = None
+
+
+def _index(kind):
+    if kind not in _indexes:
+        root = os.path.join(aenea.config.PROJECT_ROOT, 'vocabulary_config', kind)
+        compiled = aenea_grammars.cache.cache_path('vocabulary-%s.marshal' % kind)
+        _indexes[kind] = VocabularyIndex(root, compiled)
+        _indexes[kind].refresh()
+    return _indexes[kind]
+
+
+def refresh():
+    '''Check every loaded index for changed vocabulary files now.'''
+    for index in _indexes.values():
+        index.refresh()
+
+
+def get_static_vocabulary(tag):
+    return _index('static').vocabulary(tag)
+
+
+def vocabulary_list(kind, tag):
+    '''An empty list for tag's kind ('static' or 'dynamic') vocabulary, to
+       be registered later.'''
+    return DictList('%s %s' % (kind, tag))
+
+
+def _register(kind, tag, dict_list):
+    global _timer
+    if dict_list is None:
+        dict_list = vocabulary_list(kind, tag)
+    _index(kind).register(tag, dict_list)
+    if _timer is None:
+        _timer = Timer(refresh, REFRESH_INTERVAL)
+    return dict_list
+
+
+def _unregister(kind, tag, dict_list):
+    global _timer
+    _index(kind).unregister(tag, dict_list)
+    if (not any(index.registered for index in _indexes.itervalues()) and
+            _timer is not None):
+        _timer.stop()
+        _timer = None
+
+
+def register_dynamic_vocabulary(tag, dict_list=None):
+    '''A list holding tag's dynamic vocabulary and kept up to date: dict_list,
+       filled in, or a new one.'''
+    return _register('dynamic', tag, dict_list)
+
+
+def unregister_dynamic_vocabulary(tag, dict_list=None):
+    _unregister('dynamic', tag, dict_list)
+
+
+def register_static_vocabulary(tag, dict_list=None):
+    '''Like register_dynamic_vocabulary, for the static vocabulary.'''
+    return _register('static', tag, dict_list)
+
+
+def unregister_static_vocabulary(tag, dict_list=None):
+    _unregister('static', tag, dict_list)
@@ -0,0 +1,195 @@
+# Compact binary encoding of batched proxy commands.
+#
+# A batch (see aenea_grammars.batch) normally goes to the server as one
+# multiple_actions call: a JSON list with a dictionary of keyword arguments
+# for every key press. Servers that support it take a packed_actions call
+# instead, whose one argument is the whole batch packed as below and base64
+# encoded (JSON-RPC carries text only). Little-endian throughout:
+#
+#   uint32  length of the rest of the buffer
+#   uint8   VERSION
+#   uint16  number of commands, each one of
+#
+#     key_press   'K' uint8 key code, uint8 modifier bits, uint8 direction,
+#                 uint16 count, float32 count_delay (negative for none);
+#                 key code 0 is followed by uint8 length and the key name
+#     write_text  'T' uint32 length and the UTF-8 text
+#     set_clipboard
+#                 'C' uint32 length and the UTF-8 text
+#     pause       'P' float64 amount
+#
+# Key codes index KEY_NAMES, modifier bits MODIFIERS and directions
+# DIRECTIONS. Batches holding anything else, such as mouse calls, can't be
+# packed and go as multiple_actions.
+
+import base64
+import struct
+
+VERSION = 1
+
+# Index 0 means the key name is spelled out.
+KEY_NAMES = [None] + list('abcdefghijklmnopqrstuvwxyz'
+                          'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') + [
+    'space', 'tab', 'enter', 'escape', 'backspace', 'del', 'insert',
+    'up', 'down', 'left', 'right', 'home', 'end', 'pgup', 'pgdown',
+    'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'f7', 'f8', 'f9', 'f10', 'f11', 'f12',
+    'shift', 'control', 'alt', 'super',
+    'comma', 'dot', 'slash', 'backslash', 'minus', 'plus', 'equal',
+    'colon', 'semicolon', 'squote', 'dquote', 'backtick', 'tilde',
+    'exclamation', 'question', 'at', 'hash', 'dollar', 'percent', 'caret',
+    'and', 'star', 'bar', 'underscore',
+    'lparen', 'rparen', 'lbracket', 'rbracket', 'lbrace', 'rbrace',
+    'langle', 'rangle',
+    ]
+MODIFIERS = ['alt', 'control', 'shift', 'super', 'hyper', 'meta']
+DIRECTIONS = ['press', 'down', 'up']
+
+_KEY_CODES = dict((name, code) for (code, name) in enumerate(KEY_NAMES)
+                  if name is not None)
+_MODIFIER_BITS = dict((name, 1 << bit) for (bit, name) in enumerate(MODIFIERS))
+_DIRECTION_CODES = dict((name, code) for (code, name) in enumerate(DIRECTIONS))
+_TEXT_CALLS = {'write_text': 'T', 'set_clipboard': 'C'}
+_TEXT_KINDS = dict((kind, name) for (name, kind) in _TEXT_CALLS.iteritems())
+
+_HEADER = struct.Struct('<IBH')
+_KEY = struct.Struct('<cBBBHf')
+_NAME = struct.Struct('<B')
+_TEXT = struct.Struct('<cI')
+_PAUSE = struct.Struct('<cd')
+
+
+def _key_fields(args, kwargs):
+    '''(code, name, modifier bits, direction, count, delay) for a key_press,
+       or None if it can't be packed.'''
+    if args:
+        return None
+    key = kwargs.get('key')
+    if not isinstance(key, basestring) or not 0 < len(key) < 256:
+        return None
+    bits = 0
+    for modifier in kwargs.get('modifiers', ()):
+        if modifier not in _MODIFIER_BITS:
+            return None
+        bits |= _MODIFIER_BITS[modifier]
+    direction = _DIRECTION_CODES.get(kwargs.get('direction', 'press'))
+    count = kwargs.get('count', 1)
+    if direction is None or not 0 <= count < 1 << 16:
+        return None
+    delay = kwargs.get('count_delay')
+    return (_KEY_CODES.get(key, 0), str(key), bits, direction, count,
+            -1.0 if delay is None else delay)
+
+
+def pack(commands):
+    '''The packed buffer for a list of (name, args, kwargs) commands, or
+       None if any of them can't be packed.'''
+    # Check and measure everything first, then write it all into one buffer.
+    fields = []
+    size = _HEADER.size
+    for (name, args, kwargs) in commands:
+        if name == 'key_press':
+            key = _key_fields(args, kwargs)
+            if key is None:
+                return None
+            size += _KEY.size
+            if key[0] == 0:
+                size += _NAME.size + len(key[1])
+            fields.append(('K', key))
+        elif name in _TEXT_CALLS:
+            text = args[0] if args else kwargs.get('text')
+            if len(args) + len(kwargs) != 1 or not isinstance(text, basestring):
+                return None
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            size += _TEXT.size + len(text)
+            fields.append((_TEXT_CALLS[name], text))
+        elif name == 'pause':
+            amount = args[0] if args else kwargs.get('amount')
+            if len(args) + len(kwargs) != 1:
+                return None
+            size += _PAUSE.size
+            fields.append(('P', float(amount)))
+        else:
+            return None
+    if len(fields) >= 1 << 16:
+        return None
+
+    buffer = bytearray(size)
+    _HEADER.pack_into(buffer, 0, size - 4, VERSION, len(fields))
+    offset = _HEADER.size
+    for (kind, value) in fields:
+        if kind == 'K':
+            code, key, bits, direction, count, delay = value
+            _KEY.pack_into(buffer, offset, kind, code, bits, direction, count,
+                           delay)
+            offset += _KEY.size
+            if code == 0:
+                _NAME.pack_into(buffer, offset, len(key))
+                offset += _NAME.size
+                buffer[offset:offset + len(key)] = key
+                offset += len(key)
+        elif kind in _TEXT_KINDS:
+            _TEXT.pack_into(buffer, offset, kind, len(value))
+            offset += _TEXT.size
+            buffer[offset:offset + len(value)] = value
+            offset += len(value)
+        else:
+            _PAUSE.pack_into(buffer, offset, kind, value)
+            offset += _PAUSE.size
+    return str(buffer)
+
+
+def unpack(data):
+    '''The (name, args, kwargs) commands in a packed buffer.'''
+    length, version, count = _HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError('Unknown packed actions version %d' % version)
+    if length != len(data) - 4:
+        raise ValueError('Packed actions are %d bytes, not %d' % (
+            len(data) - 4, length))
+    offset = _HEADER.size
+    commands = []
+    for i in xrange(count):
+        kind = data[offset]
+        if kind == 'K':
+            kind, code, bits, direction, repeat, delay = _KEY.unpack_from(
+                data, offset)
+            offset += _KEY.size
+            if code == 0:
+                (size,) = _NAME.unpack_from(data, offset)
+                offset += _NAME.size
+                key = data[offset:offset + size]
+                offset += size
+            else:
+                key = KEY_NAMES[code]
+            commands.append(('key_press', (), {
+                'key': key,
+                'modifiers': [name for name in MODIFIERS
+                              if bits & _MODIFIER_BITS[name]],
+                'direction': DIRECTIONS[direction],
+                'count': repeat,
+                'count_delay': None if delay < 0 else delay,
+                }))
+        elif kind in _TEXT_KINDS:
+            kind, size = _TEXT.unpack_from(data, offset)
+            offset += _TEXT.size
+            commands.append((_TEXT_KINDS[kind],
+                             (data[offset:offset + size].decode('utf-8'),), {}))
+            offset += size
+        elif kind == 'P':
+            kind, amount = _PAUSE.unpack_from(data, offset)
+            offset += _PAUSE.size
+            commands.append(('pause', (amount,), {}))
+        else:
+            raise ValueError('Unknown packed action %r' % kind)
+    return commands
+
+
+def encode(commands):
+    '''pack() as the text argument of a packed_actions call, or None.'''
+    data = pack(commands)
+    return None if data is None else base64.b64encode(data)
+
+
+def decode(text):
+    return unpack(base64.b64decode(text))
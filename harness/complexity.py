@@ -0,0 +1,260 @@
+#!/usr/bin/env python2
+# Reports how big each grammar is, and checks that against a budget.
+#
+# The grammar modules are loaded against the stand-ins in harness/stubs, as
+# replay.py does, and the element tree of every rule is walked:
+#
+#   elements  elements in the rule's own tree; referenced rules are compiled
+#             once, so they count towards their own row only
+#   depth     deepest nesting of elements, following rule references
+#   paths     log10 of the number of distinct word sequences the rule
+#             accepts, following references, with each dictation counted as
+#             a single sequence and each list at its current size
+#   dictation dictation elements reachable from the rule
+#
+# and each grammar module gets the time taken to import it and to build its
+# rules. --check compares against harness/complexity_budget.json and exits
+# non-zero if any rule or module is over budget; --write-budget records the
+# current figures plus some headroom as the new budget.
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import time
+
+import replay
+
+BUDGET = os.path.join(replay.HARNESS, 'complexity_budget.json')
+
+# Headroom given by --write-budget: a fraction of the current element count,
+# depth and dictation count, and orders of magnitude of paths.
+HEADROOM = 0.25
+PATHS_HEADROOM = 1.0
+
+# Compile times vary with the machine, so their budget is more generous.
+TIME_HEADROOM = 4.0
+MINIMUM_COMPILE_MS = 50
+
+RULE_METRICS = ('elements', 'depth', 'paths', 'dictation')
+
+
+class Analyzer(object):
+    def __init__(self):
+        import dragonfly
+        self.dragonfly = dragonfly
+        self._rules = {}
+
+    def rule(self, rule):
+        '''(elements, depth, paths, dictation) for a rule, paths being the
+           actual count rather than its logarithm.'''
+        # Keyed on the rule itself, which keeps it alive: once a grammar is
+        # dropped, the ids of its rules are free to be reused.
+        if rule not in self._rules:
+            # Guard against recursive rules while this one is analyzed.
+            self._rules[rule] = (0, 0, 1, 0)
+            self._rules[rule] = self.element(rule.element)
+        return self._rules[rule]
+
+    def element(self, element):
+        df = self.dragonfly
+        if isinstance(element, df.RuleRef):
+            elements, depth, paths, dictation = self.rule(element.rule)
+            return (1, depth + 1, paths, dictation)
+        if isinstance(element, df.Literal):
+            return (1, 1, 1, 0)
+        if isinstance(element, df.Dictation):
+            return (1, 1, 1, 1)
+        if isinstance(element, df.ListRef):
+            return (1, 1, max(1, len(element.list)), 0)
+        if isinstance(element, df.Integer):
+            if element.max is None:
+                return (1, 1, 1, 0)
+            return (1, 1, max(1, element.max - element.min), 0)
+        if isinstance(element, df.Optional):
+            elements, depth, paths, dictation = self.element(element.child)
+            return (elements + 1, depth + 1, paths + 1, dictation)
+        if isinstance(element, df.Repetition):
+            elements, depth, paths, dictation = self.element(element.child)
+            # Repetition's max is exclusive, as in dragonfly.
+            total = sum(paths ** count
+                        for count in range(element.min, element.max))
+            return (elements + 1, depth + 1, total, dictation)
+        if isinstance(element, (df.Sequence, df.Alternative)):
+            children = [self.element(child) for child in element.children]
+            if isinstance(element, df.Sequence):
+                paths = 1
+                for child in children:
+                    paths *= child[2]
+            else:
+                paths = sum(child[2] for child in children)
+            return (1 + sum(child[0] for child in children),
+                    1 + max([child[1] for child in children] or [0]),
+                    paths,
+                    sum(child[3] for child in children))
+        raise TypeError('Unknown element %r' % (element,))
+
+
+def log10(count):
+    # Counts can be far too big for a float.
+    digits = len(str(count))
+    if digits < 300:
+        return round(math.log10(max(count, 1)), 2)
+    return float(digits - 1)
+
+
+def module_grammars(module):
+    '''Build every grammar a module created, timing the builds.'''
+    import aenea_grammars.lazy
+    import aenea_grammars.reload
+    import dragonfly
+    grammars = []
+    for value in vars(module).values():
+        if isinstance(value, aenea_grammars.reload.ReloadableGrammar):
+            # Time a rebuild, but report the loaded grammar: a rebuilt one
+            # only has its vocabulary lists filled once it is swapped in.
+            start = time.time()
+            value.discard(value.build())
+            grammars.append((value.grammar, time.time() - start))
+        elif isinstance(value, aenea_grammars.lazy.LazyGrammar):
+            start = time.time()
+            grammar = value.build()
+            grammars.append((grammar, time.time() - start))
+        elif isinstance(value, dragonfly.Grammar):
+            grammars.append((value, 0.0))
+    return grammars
+
+
+def referenced_rules(rule, found):
+    import dragonfly
+    stack = [rule.element]
+    while stack:
+        element = stack.pop()
+        if isinstance(element, dragonfly.RuleRef):
+            if element.rule.name not in found:
+                found[element.rule.name] = element.rule
+                stack.append(element.rule.element)
+            continue
+        stack.extend(getattr(element, 'children', ()))
+        if hasattr(element, 'child'):
+            stack.append(element.child)
+    return found
+
+
+def measure():
+    '''Returns {module: {'load': seconds, 'build': seconds, 'rules':
+       {rule: {metric: value}}}}.'''
+    project_root = replay.setup()
+    try:
+        return _measure()
+    finally:
+        shutil.rmtree(project_root, ignore_errors=True)
+
+
+def _measure():
+    analyzer = Analyzer()
+    report = {}
+    modules = replay.load_grammars()
+    for (name, (module, seconds)) in sorted(modules.iteritems()):
+        rules = {}
+        build = 0.0
+        for (grammar, build_seconds) in module_grammars(module):
+            build += build_seconds
+            for rule in grammar.rules:
+                for (rule_name, each) in sorted(
+                        referenced_rules(rule, {rule.name: rule}).iteritems()):
+                    elements, depth, paths, dictation = analyzer.rule(each)
+                    rules[rule_name] = {
+                        'elements': elements,
+                        'depth': depth,
+                        'paths': log10(paths),
+                        'dictation': dictation,
+                        }
+        report[name] = {'load': seconds, 'build': build, 'rules': rules}
+    replay.unload_grammars(modules)
+    return report
+
+
+def print_report(report):
+    for (name, module) in sorted(report.iteritems()):
+        print '%s: import %.1f ms, build %.1f ms' % (
+            name, module['load'] * 1000, module['build'] * 1000)
+        print '    %-36s %8s %6s %8s %9s' % (('rule',) + RULE_METRICS)
+        for (rule, metrics) in sorted(module['rules'].iteritems()):
+            print '    %-36s %8d %6d %8.2f %9d' % (
+                (rule,) + tuple(metrics[metric] for metric in RULE_METRICS))
+
+
+def make_budget(report):
+    budget = {}
+    for (name, module) in report.iteritems():
+        compile_ms = 1000 * (module['load'] + module['build'])
+        rules = {}
+        for (rule, metrics) in module['rules'].iteritems():
+            limits = dict((metric, int(math.ceil(metrics[metric] * (1 + HEADROOM))))
+                          for metric in ('elements', 'depth', 'dictation'))
+            limits['paths'] = metrics['paths'] + PATHS_HEADROOM
+            rules[rule] = limits
+        budget[name] = {
+            'compile_ms': max(MINIMUM_COMPILE_MS,
+                              int(math.ceil(compile_ms * (1 + TIME_HEADROOM)))),
+            'rules': rules,
+            }
+    return budget
+
+
+def check(report, budget):
+    '''Returns a list of budget violations.'''
+    failures = []
+    for (name, module) in sorted(report.iteritems()):
+        limits = budget.get(name)
+        if limits is None:
+            failures.append('%s: no budget' % name)
+            continue
+        compile_ms = 1000 * (module['load'] + module['build'])
+        if compile_ms > limits['compile_ms']:
+            failures.append('%s: compile %.1f ms over budget of %.1f ms' % (
+                name, compile_ms, limits['compile_ms']))
+        for (rule, metrics) in sorted(module['rules'].iteritems()):
+            rule_limits = limits['rules'].get(rule)
+            if rule_limits is None:
+                failures.append('%s %s: no budget' % (name, rule))
+                continue
+            for metric in RULE_METRICS:
+                if metrics[metric] > rule_limits[metric]:
+                    failures.append('%s %s: %s %s over budget of %s' % (
+                        name, rule, metric, metrics[metric], rule_limits[metric]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', default=BUDGET)
+    parser.add_argument('--check', action='store_true',
+                        help='exit non-zero if any figure is over budget')
+    parser.add_argument('--write-budget', action='store_true',
+                        help='record the current figures as the budget')
+    parser.add_argument('--quiet', action='store_true')
+    arguments = parser.parse_args()
+
+    report = measure()
+    if not arguments.quiet:
+        print_report(report)
+    if arguments.write_budget:
+        with open(arguments.budget, 'w') as fd:
+            json.dump(make_budget(report), fd, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+            fd.write('\n')
+    if arguments.check:
+        with open(arguments.budget) as fd:
+            failures = check(report, json.load(fd))
+        for failure in failures:
+            print 'OVER BUDGET %s' % failure
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# A stand-in for an Aenea server that pushes context changes, for
+# aenea_grammars.context.subscribe(). It runs in process: connect() hands
+# out the server itself, and set_context() is what a focus change would do.
+
+import threading
+import time
+
+
+class PushServer(object):
+    def __init__(self, platform='linux'):
+        self.platform = platform
+        self.serial = 0
+        self.context = {}
+        self.watches = 0
+        self._changed = threading.Condition()
+
+    def connect(self):
+        return self
+
+    def set_context(self, context):
+        '''Make context the remote foreground window, waking any watch.
+           Returns its serial.'''
+        with self._changed:
+            if context != self.context:
+                self.context = dict(context)
+                self.serial += 1
+                self._changed.notify_all()
+            return self.serial
+
+    def close(self):
+        '''Answer any outstanding watch straight away.'''
+        with self._changed:
+            self._changed.notify_all()
+
+    def server_info(self):
+        return {'platform': self.platform}
+
+    def get_context(self):
+        with self._changed:
+            return dict(self.context)
+
+    def watch_context(self, serial, timeout):
+        with self._changed:
+            self.watches += 1
+            if serial == self.serial:
+                self._changed.wait(timeout)
+            return {'serial': self.serial, 'context': dict(self.context)}
+
+    def deliver(self, subscription, context, timeout=1.0):
+        '''set_context(), then wait until subscription has received it.'''
+        serial = self.set_context(context)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            current = subscription.current()
+            if current is not None and current[0] == serial:
+                return True
+            time.sleep(0.001)
+        return False
@@ -0,0 +1,312 @@
+#!/usr/bin/env python2
+# Replays recorded utterances through the grammars in this repository without
+# a speech engine, using the stand-in dragonfly and aenea in harness/stubs.
+# For every utterance it reports the rule that matched, the keystrokes sent
+# to the (recording) Aenea server, the number of server round trips, and how
+# long parsing, value computation and processing took.
+#
+# Recordings are plain text. Lines starting with # are comments, a line in
+# square brackets sets the focused window for the lines that follow, and
+# every other line is one utterance:
+#
+#   [title="main.py - VIM" cls=gvim executable=gvim]
+#   dell three down
+#
+# --save writes the rules matched and the resulting event streams to a JSON
+# file; --compare checks a later run against such a file and exits non-zero
+# on any difference, so grammar changes can be checked before deploying.
+# --instrument turns on aenea_grammars.instrument and dumps what it recorded,
+# and fails the run if a recognition that sent input to the server reports
+# no dispatches.
+# --push has contexts follow a stand-in server that pushes focus changes
+# (push_server.py) instead of querying the recording server. --wire records
+# with a server that accepts packed batches (wire_server.py).
+
+import argparse
+import imp
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+
+HARNESS = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(HARNESS)
+
+GRAMMARS = ['multiedit', 'vim', 'git', 'chromium', 'awesome']
+
+# Server calls made to evaluate contexts rather than to send input.
+QUERIES = frozenset(['get_context', 'server_info'])
+
+
+def make_project_root(instrument=None):
+    '''A scratch Aenea project root holding the example grammar
+       configuration and the repository's vocabulary, with instrumentation
+       dumping to instrument if given.'''
+    root = tempfile.mkdtemp(prefix='aenea-replay-')
+    os.mkdir(os.path.join(root, 'grammar_config'))
+    for grammar in GRAMMARS:
+        example = os.path.join(REPOSITORY, '_' + grammar, grammar + '.json.example')
+        if not os.path.exists(example):
+            continue
+        try:
+            with open(example) as fd:
+                json.load(fd)
+        except ValueError as e:
+            print >> sys.stderr, 'Skipping invalid %s: %s' % (example, e)
+            continue
+        shutil.copy(example, os.path.join(root, 'grammar_config', grammar + '.json'))
+    shutil.copytree(os.path.join(REPOSITORY, 'vocabulary_config'),
+                    os.path.join(root, 'vocabulary_config'))
+    if instrument:
+        with open(os.path.join(root, 'grammar_config', 'instrument.json'), 'w') as fd:
+            json.dump({'enabled': True, 'dump_file': os.path.abspath(instrument)}, fd)
+    return root
+
+
+def setup(project_root=None, instrument=None):
+    '''Put the stand-ins on the path and point them at a project root.'''
+    if project_root is None:
+        project_root = make_project_root(instrument)
+    os.environ['AENEA_PROJECT_ROOT'] = project_root
+    sys.path.insert(0, REPOSITORY)
+    sys.path.insert(0, os.path.join(HARNESS, 'stubs'))
+    return project_root
+
+
+def load_grammars(names=GRAMMARS):
+    '''Import grammar modules; returns a dict of name to (module, seconds).'''
+    modules = {}
+    for name in names:
+        path = os.path.join(REPOSITORY, '_' + name, '_' + name + '.py')
+        start = time.time()
+        module = imp.load_source('_' + name, path)
+        modules[name] = (module, time.time() - start)
+    return modules
+
+
+def unload_grammars(modules):
+    '''Unload modules from load_grammars(), waiting for the context
+       subscription they share to stop rather than cutting it off at exit.'''
+    import aenea_grammars.context
+    aenea_grammars.context.subscribe()
+    for (module, seconds) in modules.itervalues():
+        module.unload()
+    aenea_grammars.context.unsubscribe(timeout=1)
+
+
+class Utterance(object):
+    def __init__(self, window, words, line):
+        self.window = window
+        self.words = words
+        self.line = line
+
+
+def read_recordings(path):
+    window = {}
+    utterances = []
+    with open(path) as fd:
+        for (number, line) in enumerate(fd, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('['):
+                window = dict(item.split('=', 1)
+                              for item in shlex.split(line.strip('[]')))
+                continue
+            utterances.append(Utterance(dict(window), line.split(), number))
+    return utterances
+
+
+def describe_events(events):
+    described = []
+    for event in events:
+        if event[0] == 'key':
+            key = '-'.join(list(event[2]) + [event[1]])
+            if event[3] != 'press':
+                key += ':' + event[3]
+            if described and described[-1][0] == key:
+                described[-1][1] += 1
+            else:
+                described.append([key, 1])
+        elif event[0] == 'text':
+            described.append([repr(event[1]), 1])
+        else:
+            described.append([' '.join(str(part) for part in event), 1])
+    return ' '.join(item if count == 1 else '%s x%d' % (item, count)
+                    for (item, count) in described)
+
+
+def replay(utterance, push=None):
+    '''Mimic one utterance. push, if given, is a (PushServer, Subscription)
+       pair to deliver the window through.'''
+    import aenea.communications
+    import dragonfly
+
+    server = aenea.communications.recorder
+    server.context = {
+        'title': utterance.window.get('title', ''),
+        'cls': utterance.window.get('cls', ''),
+        'cls_name': utterance.window.get('cls', ''),
+        'executable': utterance.window.get('executable', ''),
+        }
+    server.reset()
+    # Utterances are further apart than the shared context snapshot lives.
+    shared_context = sys.modules.get('aenea_grammars.context')
+    if shared_context is not None:
+        shared_context.invalidate()
+    if push is not None:
+        (push_server, subscription) = push
+        if not push_server.deliver(subscription, server.context):
+            print >> sys.stderr, 'Context push not received for %r' % (
+                ' '.join(utterance.words),)
+    recognition = dragonfly.get_engine().mimic(
+        utterance.words,
+        executable=utterance.window.get('executable', ''),
+        title=utterance.window.get('title', ''),
+        handle=0)
+    # Pipelined actions may still be on their way to the server.
+    pipeline = sys.modules.get('aenea_grammars.pipeline')
+    if pipeline is not None:
+        pipeline.barrier()
+    return recognition, list(server.dispatches), server.effect()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def unreported_dispatches(dispatches, recognitions):
+    '''An error message if the latest instrumented recognition, in
+       recognitions, reports no dispatches although input was sent.'''
+    sent = [name for (name, args, kwargs) in dispatches if name not in QUERIES]
+    if recognitions and sent and not recognitions[-1].dispatches:
+        return 'rule %s reported 0 dispatches, but %d were made' % (
+            recognitions[-1].rule, len(sent))
+    return None
+
+
+def run(arguments):
+    '''Replay, report and compare as main()'s arguments say, once set up.'''
+    if arguments.wire:
+        import aenea.communications
+        import wire_server
+        # Before the grammars load, as they may wrap the server.
+        aenea.communications.server = wire_server.PackingServer()
+        aenea.communications.recorder = aenea.communications.server
+    push = None
+    if arguments.push:
+        import aenea_grammars.context
+        import push_server
+        server = push_server.PushServer()
+        # Subscribing first makes the grammar modules share this one.
+        push = (server, aenea_grammars.context.subscribe(server.connect))
+    modules = load_grammars()
+    for (name, (module, seconds)) in sorted(modules.iteritems()):
+        if not arguments.quiet:
+            print 'loaded %-10s %8.2f ms' % (name, seconds * 1000)
+
+    history = None
+    if arguments.instrument:
+        import aenea_grammars.instrument
+        history = aenea_grammars.instrument.history()
+    instrument_failures = 0
+
+    results = []
+    for path in arguments.recordings:
+        for utterance in read_recordings(path):
+            timings = dict((phase, []) for phase in ('parse', 'value', 'process'))
+            for i in range(arguments.repeat):
+                recorded = history.count if history is not None else 0
+                recognition, dispatches, effect = replay(utterance, push)
+                for (phase, seconds) in recognition.timings.iteritems():
+                    timings[phase].append(seconds)
+                if history is not None and history.count > recorded:
+                    error = unreported_dispatches(dispatches,
+                                                  history.recognitions)
+                    if error is not None:
+                        instrument_failures += 1
+                        print 'INSTRUMENT %r: %s' % (
+                            ' '.join(utterance.words), error)
+            rule = recognition.rule.name if recognition.rule else None
+            results.append({
+                'window': utterance.window,
+                'words': ' '.join(utterance.words),
+                'rule': rule,
+                'effect': effect,
+                })
+            if arguments.quiet:
+                continue
+            phases = '  '.join(
+                '%s %7.3f' % (phase, 1000 * percentile(values, 0.5))
+                for (phase, values) in sorted(timings.iteritems()) if values)
+            if arguments.repeat > 1:
+                phases += '  p95 process %7.3f' % (
+                    1000 * percentile(timings['process'] or [0], 0.95))
+            print '%s:%d  %s' % (os.path.basename(path), utterance.line,
+                                 ' '.join(utterance.words))
+            queries = len([name for (name, args, kwargs) in dispatches
+                           if name in QUERIES])
+            print '    rule %s, %d dispatches + %d context queries, ms: %s' % (
+                rule, len(dispatches) - queries, queries, phases)
+            print '    %s' % describe_events(effect)
+
+    if arguments.instrument:
+        aenea_grammars.instrument.dump()
+    if push is not None:
+        aenea_grammars.context.unsubscribe()
+        push[0].close()
+    unload_grammars(modules)
+
+    # Round trip through JSON so tuples compare equal to saved lists.
+    results = json.loads(json.dumps(results))
+    if arguments.save:
+        with open(arguments.save, 'w') as fd:
+            fd.write('[\n%s\n]\n' % ',\n'.join(
+                json.dumps(result, sort_keys=True) for result in results))
+    if arguments.compare:
+        with open(arguments.compare) as fd:
+            expected = json.load(fd)
+        failures = 0
+        for (got, wanted) in map(None, results, expected):
+            if got != wanted:
+                failures += 1
+                print 'MISMATCH %r' % ((wanted or got)['words'],)
+                print '    expected %r' % (wanted,)
+                print '    got      %r' % (got,)
+        if failures:
+            print '%d of %d utterances differ' % (failures, len(expected))
+            sys.exit(1)
+    if instrument_failures:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recordings', nargs='+')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='replay each utterance this many times and '
+                             'report median and 95th percentile timings')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare results against this JSON file')
+    parser.add_argument('--instrument',
+                        help='dump aenea_grammars.instrument data to this file')
+    parser.add_argument('--push', action='store_true',
+                        help='deliver windows through a context push server')
+    parser.add_argument('--wire', action='store_true',
+                        help='record with a server accepting packed batches')
+    parser.add_argument('--quiet', action='store_true')
+    arguments = parser.parse_args()
+
+    project_root = setup(instrument=arguments.instrument)
+    try:
+        run(arguments)
+    finally:
+        shutil.rmtree(project_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Stand-in for the parts of the Aenea client used by the grammars in this
+# repository. Proxied actions are sent to a recording server (see
+# communications) instead of a real Aenea server.
+
+import aenea.config
+import aenea.communications
+import aenea.proxy_contexts
+import aenea.wrappers
+
+from dragonfly import (
+    Alternative,
+    AppContext,
+    CompoundRule,
+    Dictation,
+    DictList,
+    DictListRef,
+    Grammar,
+    IntegerRef,
+    List,
+    ListRef,
+    Literal,
+    MappingRule,
+    Repetition,
+    RuleRef,
+    Sequence
+    )
+
+from aenea.proxy_contexts import (
+    ProxyAppContext,
+    ProxyPlatformContext
+    )
+
+from aenea.wrappers import (
+    AeneaContext,
+    AlwaysContext,
+    Key,
+    NeverContext,
+    NoAction,
+    Text
+    )
@@ -0,0 +1,93 @@
+# A recording stand-in for the Aenea server. It keeps the log of every RPC
+# (a "dispatch") and the resulting stream of input events, and answers
+# context queries from the window the replay driver says is focused.
+
+
+class RecordingServer(object):
+    def __init__(self):
+        self.context = {}
+        self.platform = 'linux'
+        self.clipboard = ''
+        self.reset()
+
+    def reset(self):
+        self.dispatches = []
+        self.events = []
+
+    # Each public call made by the client is one round trip.
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self, '_rpc_' + name, None)
+        if method is None:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.dispatches.append((name, args, kwargs))
+            return method(*args, **kwargs)
+        return call
+
+    def _rpc_multiple_actions(self, actions):
+        for (name, args, kwargs) in actions:
+            getattr(self, '_rpc_' + name)(*args, **kwargs)
+
+    def _rpc_key_press(self, key=None, modifiers=(), direction='press',
+                       count=1, count_delay=None):
+        for i in range(count):
+            self.events.append(('key', key, tuple(modifiers), direction))
+
+    def _rpc_write_text(self, text):
+        self.events.append(('text', text))
+
+    def _rpc_click_mouse(self, button, direction='click', count=1,
+                         count_delay=None):
+        self.events.append(('click', button, direction, count))
+
+    def _rpc_move_mouse(self, x, y, reference='absolute', proportional=False,
+                        phantom=None):
+        self.events.append(('move', x, y, reference, proportional))
+
+    def _rpc_pause(self, amount):
+        self.events.append(('pause', amount))
+
+    def _rpc_get_clipboard(self):
+        return self.clipboard
+
+    def _rpc_set_clipboard(self, text):
+        self.clipboard = text
+        self.events.append(('clipboard', text))
+
+    def _rpc_get_context(self):
+        return dict(self.context)
+
+    def _rpc_server_info(self):
+        return {'platform': self.platform}
+
+    def effect(self):
+        '''The events as a flat, normalized list: text runs are merged so
+           that equivalent event streams compare equal.'''
+        effect = []
+        for event in self.events:
+            if event[0] == 'text' and effect and effect[-1][0] == 'text':
+                effect[-1] = ('text', effect[-1][1] + event[1])
+            else:
+                effect.append(event)
+        return effect
+
+
+# Grammars may wrap server; the harness reads the recording from recorder.
+server = recorder = RecordingServer()
+
+
+class Proxy(object):
+    '''A further connection to the stand-in server, such as context
+       subscriptions open. Like a stock Aenea server, it cannot push.'''
+
+    def __init__(self, host, port, socket_timeout=0.1):
+        self.address = (host, port)
+
+    def server_info(self):
+        return {'platform': recorder.platform}
+
+    def watch_context(self, serial, timeout):
+        raise Exception('Method not found: watch_context')
@@ -0,0 +1,17 @@
+import os
+
+HOST = 'localhost'
+PORT = 8240
+
+PROJECT_ROOT = os.environ.get('AENEA_PROJECT_ROOT', os.getcwd())
+
+_proxy_active = True
+
+
+def proxy_active():
+    return _proxy_active
+
+
+def set_proxy_active(active):
+    global _proxy_active
+    _proxy_active = active
@@ -0,0 +1,30 @@
+import json
+import os
+
+import aenea.config
+
+
+class ConfigWatcher(object):
+    def __init__(self, path, default={}):
+        self._path = os.path.join(aenea.config.PROJECT_ROOT, *path) + '.json'
+        self._default = default
+        self.refresh()
+
+    def refresh(self):
+        try:
+            with open(self._path) as fd:
+                self.conf = json.load(fd)
+        except (IOError, ValueError):
+            self.conf = dict(self._default)
+        return False
+
+
+def make_grammar_commands(module_name, mapping, config_key='commands'):
+    conf = ConfigWatcher(('grammar_config', module_name)).conf.get(config_key, {})
+    commands = dict(mapping)
+    # The user's aliases replace the default spoken forms they name.
+    for default_phrase in set(conf.itervalues()):
+        commands.pop(str(default_phrase), None)
+    for (user_phrase, default_phrase) in conf.iteritems():
+        commands[str(user_phrase)] = mapping[str(default_phrase)]
+    return commands
@@ -0,0 +1,4 @@
+from aenea.wrappers import (
+    Key,
+    Text
+    )
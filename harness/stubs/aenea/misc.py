@@ -0,0 +1,33 @@
+from dragonfly import (
+    MappingRule,
+    Repetition,
+    RuleRef
+    )
+
+LETTERS = dict((word, word[0]) for word in (
+    'alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo '
+    'lima mike november oscar papa quebec romeo sierra tango uniform victor '
+    'whiskey xray yankee zulu').split())
+LETTERS.update(('upper ' + word, letter.upper())
+               for (word, letter) in LETTERS.items())
+
+DIGITS = dict((word, str(value)) for (value, word) in enumerate(
+    'zero one two three four five six seven eight nine'.split()))
+
+ALPHANUMERIC = dict(LETTERS)
+ALPHANUMERIC.update(DIGITS)
+
+
+class _DigitRule(MappingRule):
+    exported = False
+    mapping = DIGITS
+
+
+class DigitalInteger(Repetition):
+    child = RuleRef(_DigitRule(), name='digit')
+
+    def __init__(self, name, min, max, *args, **kwargs):
+        Repetition.__init__(self, self.child, min, max, name=name, *args, **kwargs)
+
+    def value(self, node):
+        return int(''.join(Repetition.value(self, node)))
@@ -0,0 +1,51 @@
+import re
+
+import aenea.communications
+import aenea.config
+
+from dragonfly import Context
+
+
+class ProxyAppContext(Context):
+    def __init__(self, cls=None, cls_name=None, executable=None, title=None,
+                 match='substring', logic='and', case_sensitive=False,
+                 query=True):
+        self.match = match
+        self.logic = logic
+        self.case_sensitive = case_sensitive
+        self.arguments = dict((key, value) for (key, value) in (
+            ('cls', cls),
+            ('cls_name', cls_name),
+            ('executable', executable),
+            ('title', title)) if value is not None)
+
+    def _match(self, expected, actual):
+        if not self.case_sensitive and self.match != 'regex':
+            expected = expected.lower()
+            actual = actual.lower()
+        if self.match == 'regex':
+            return re.match(expected, actual) is not None
+        elif self.match == 'exact':
+            return expected == actual
+        return expected in actual
+
+    def matches(self, executable, title, handle):
+        if not aenea.config.proxy_active():
+            return False
+        context = aenea.communications.server.get_context()
+        results = [self._match(expected, context.get(key, ''))
+                   for (key, expected) in self.arguments.iteritems()]
+        if self.logic == 'or':
+            return any(results)
+        return all(results)
+
+
+class ProxyPlatformContext(Context):
+    def __init__(self, platform):
+        self.platform = platform
+
+    def matches(self, executable, title, handle):
+        if not aenea.config.proxy_active():
+            return False
+        info = aenea.communications.server.server_info()
+        return info.get('platform') == self.platform
@@ -0,0 +1,81 @@
+# Loads vocabulary_config the way Aenea does: "vocabulary" entries become
+# Text actions and "shortcuts" entries Key actions (or a series of actions).
+
+import json
+import os
+
+import aenea.config
+
+from dragonfly import DictList
+
+from aenea.wrappers import (
+    Key,
+    NoAction,
+    Text
+    )
+
+_ACTION_TYPES = {
+    'Key': Key,
+    'Text': Text,
+    }
+
+_dynamic = {}
+_inhibited = {}
+
+
+def _files(kind):
+    root = os.path.join(aenea.config.PROJECT_ROOT, 'vocabulary_config', kind)
+    if not os.path.isdir(root):
+        return
+    for name in sorted(os.listdir(root)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(root, name)) as fd:
+            contents = json.load(fd)
+        if isinstance(contents, dict):
+            contents = [contents]
+        for section in contents:
+            yield section
+
+
+def _build_action(value, action_type):
+    if isinstance(value, list):
+        action = NoAction()
+        for item in value:
+            action = action + _ACTION_TYPES[item['type']](*item['args'])
+        return action
+    return action_type(str(value))
+
+
+def _load(kind, tag):
+    vocabulary = {}
+    for section in _files(kind):
+        if tag not in section.get('tags', ()):
+            continue
+        for (phrase, value) in section.get('vocabulary', {}).iteritems():
+            vocabulary[str(phrase)] = _build_action(value, Text)
+        for (phrase, value) in section.get('shortcuts', {}).iteritems():
+            vocabulary[str(phrase)] = _build_action(value, Key)
+    return vocabulary
+
+
+def get_static_vocabulary(tag):
+    return _load('static', tag)
+
+
+def register_dynamic_vocabulary(tag):
+    if tag not in _dynamic:
+        _dynamic[tag] = DictList('dynamic %s' % tag, _load('dynamic', tag))
+    return _dynamic[tag]
+
+
+def unregister_dynamic_vocabulary(tag):
+    _dynamic.pop(tag, None)
+
+
+def inhibit_global_dynamic_vocabulary(grammar_name, tags, context=None):
+    _inhibited[grammar_name] = (tags, context)
+
+
+def uninhibit_global_dynamic_vocabulary(grammar_name, tags):
+    _inhibited.pop(grammar_name, None)
@@ -0,0 +1,82 @@
+import aenea.communications
+import aenea.config
+
+from dragonfly import (
+    ActionBase,
+    Context,
+    DynStrActionBase
+    )
+
+_MODIFIERS = {
+    'a': 'alt',
+    'c': 'control',
+    's': 'shift',
+    'w': 'super',
+    'W': 'super',
+    }
+
+
+def parse_key_spec(spec):
+    '''Parse a dragonfly Key spec into key_press keyword arguments.'''
+    events = []
+    for item in spec.split(','):
+        item = item.strip()
+        delay = None
+        if '/' in item:
+            item, delay = item.split('/', 1)
+            delay = float(delay)
+        modifiers = []
+        if '-' in item[1:]:
+            prefix, item = item.split('-', 1)
+            modifiers = [_MODIFIERS[character] for character in prefix]
+        direction = 'press'
+        count = 1
+        if ':' in item:
+            item, parameter = item.split(':', 1)
+            if parameter in ('down', 'up'):
+                direction = parameter
+            else:
+                count = int(parameter)
+        events.append({
+            'key': item,
+            'modifiers': modifiers,
+            'direction': direction,
+            'count': count,
+            'count_delay': delay,
+            })
+    return events
+
+
+class Key(DynStrActionBase):
+    def _execute_spec(self, spec):
+        for event in parse_key_spec(spec):
+            aenea.communications.server.key_press(**event)
+
+
+class Text(DynStrActionBase):
+    def _execute_spec(self, spec):
+        aenea.communications.server.write_text(spec)
+
+
+class NoAction(ActionBase):
+    pass
+
+
+class AeneaContext(Context):
+    def __init__(self, proxy_context, local_context):
+        self._proxy_context = proxy_context
+        self._local_context = local_context
+
+    def matches(self, executable, title, handle):
+        if aenea.config.proxy_active():
+            return self._proxy_context.matches(executable, title, handle)
+        return self._local_context.matches(executable, title, handle)
+
+
+class AlwaysContext(Context):
+    pass
+
+
+class NeverContext(Context):
+    def matches(self, executable, title, handle):
+        return False
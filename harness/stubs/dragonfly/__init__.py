@@ -0,0 +1,786 @@
+# Stand-in for the parts of dragonfly used by the grammars in this
+# repository, so recognitions can be replayed without a speech engine.
+#
+# Parse trees mirror dragonfly's layout (a rule node wraps the rule's element
+# node, a RuleRef node wraps the referenced rule's node, a Compound node wraps
+# the element parsed from its spec), so value() methods which index into
+# node.children see the same structure they would under a real engine.
+
+import copy
+import re
+import time
+
+
+class GrammarError(Exception):
+    pass
+
+
+#---------------------------------------------------------------------------
+# Parse tree
+
+
+class Node(object):
+    def __init__(self, actor, words, children=()):
+        self.actor = actor
+        self.children = list(children)
+        self._words = words
+
+    @property
+    def name(self):
+        return self.actor.name
+
+    @property
+    def results(self):
+        return [(word, 0) for word in self._words]
+
+    def words(self):
+        return list(self._words)
+
+    def value(self):
+        return self.actor.value(self)
+
+    def get_child_by_name(self, name, shallow=False):
+        for child in self.children:
+            if child.name:
+                if child.name == name:
+                    return child
+                if shallow:
+                    # Named nodes are opaque in a shallow search.
+                    continue
+            match = child.get_child_by_name(name, shallow)
+            if match is not None:
+                return match
+        return None
+
+
+#---------------------------------------------------------------------------
+# Elements. decode(words, position) yields (node, end) for every way the
+# element can match words starting at position, preferred matches first.
+
+
+class ElementBase(object):
+    def __init__(self, name=None, default=None):
+        self.name = name
+        self.default = default
+
+    def has_default(self):
+        return self.default is not None
+
+    def children_elements(self):
+        return ()
+
+    def value(self, node):
+        return [child.value() for child in node.children]
+
+
+class Literal(ElementBase):
+    def __init__(self, text, name=None, value=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.text = text
+        self._literal_words = [word.lower() for word in text.split()]
+        self._value = value
+
+    def decode(self, words, position):
+        end = position + len(self._literal_words)
+        if [word.lower() for word in words[position:end]] == self._literal_words:
+            yield Node(self, words[position:end]), end
+
+    def value(self, node):
+        if self._value is not None:
+            return self._value
+        return ' '.join(node.words())
+
+
+class Sequence(ElementBase):
+    def __init__(self, children=(), name=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.children = tuple(children)
+
+    def children_elements(self):
+        return self.children
+
+    def decode(self, words, position):
+        for nodes, end in self._decode_from(0, words, position):
+            yield Node(self, words[position:end], nodes), end
+
+    def _decode_from(self, index, words, position):
+        if index == len(self.children):
+            yield [], position
+            return
+        for node, end in self.children[index].decode(words, position):
+            for rest, final in self._decode_from(index + 1, words, end):
+                yield [node] + rest, final
+
+
+class Alternative(ElementBase):
+    def __init__(self, children=(), name=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.children = tuple(children)
+
+    def children_elements(self):
+        return self.children
+
+    def decode(self, words, position):
+        for child in self.children:
+            for node, end in child.decode(words, position):
+                yield Node(self, words[position:end], [node]), end
+
+    def value(self, node):
+        return node.children[0].value()
+
+
+class Optional(ElementBase):
+    def __init__(self, child, name=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.child = child
+
+    def children_elements(self):
+        return (self.child,)
+
+    def decode(self, words, position):
+        for node, end in self.child.decode(words, position):
+            yield Node(self, words[position:end], [node]), end
+        yield Node(self, []), position
+
+    def value(self, node):
+        if node.children:
+            return node.children[0].value()
+        return self.default
+
+
+class Repetition(ElementBase):
+    # As in dragonfly, max is exclusive and defaults to min + 1.
+    def __init__(self, child, min=1, max=None, name=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.child = child
+        self.min = min
+        self.max = max if max is not None else min + 1
+
+    def children_elements(self):
+        return (self.child,)
+
+    def decode(self, words, position):
+        for nodes, end in self._decode_from(0, words, position):
+            yield Node(self, words[position:end], nodes), end
+
+    def _decode_from(self, count, words, position):
+        if count + 1 < self.max:
+            for node, end in self.child.decode(words, position):
+                if end == position:
+                    continue
+                for rest, final in self._decode_from(count + 1, words, end):
+                    yield [node] + rest, final
+        if count >= self.min:
+            yield [], position
+
+
+class RuleRef(ElementBase):
+    def __init__(self, rule, name=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.rule = rule
+
+    def children_elements(self):
+        return (self.rule.element,)
+
+    def decode(self, words, position):
+        for node, end in self.rule.decode(words, position):
+            yield Node(self, words[position:end], [node]), end
+
+    def value(self, node):
+        return node.children[0].value()
+
+
+class ListRef(ElementBase):
+    def __init__(self, name, list, key=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.list = list
+
+    def _entries(self):
+        return self.list
+
+    def decode(self, words, position):
+        lowered = [word.lower() for word in words]
+        for entry in sorted(self._entries(), key=lambda e: -len(e.split())):
+            entry_words = entry.lower().split()
+            end = position + len(entry_words)
+            if entry_words and lowered[position:end] == entry_words:
+                yield Node(self, words[position:end]), end
+
+    def value(self, node):
+        return ' '.join(node.words())
+
+
+class DictListRef(ListRef):
+    def value(self, node):
+        return self.list[' '.join(node.words())]
+
+
+class DictationContainer(object):
+    def __init__(self, words):
+        self.words = words
+
+    def format(self):
+        return ' '.join(self.words)
+
+    def __str__(self):
+        return self.format()
+
+
+class Dictation(ElementBase):
+    def __init__(self, name=None, format=True, default=None):
+        ElementBase.__init__(self, name, default)
+
+    def decode(self, words, position):
+        # Greedy: prefer the longest dictation, as the engine tends to.
+        for end in range(len(words), position, -1):
+            yield Node(self, words[position:end]), end
+
+    def value(self, node):
+        return DictationContainer(node.words())
+
+
+_NUMBER_UNITS = dict((word, value) for (value, word) in enumerate(
+    'zero one two three four five six seven eight nine ten eleven twelve '
+    'thirteen fourteen fifteen sixteen seventeen eighteen nineteen'.split()))
+_NUMBER_TENS = dict((word, 10 * (value + 2)) for (value, word) in enumerate(
+    'twenty thirty forty fifty sixty seventy eighty ninety'.split()))
+
+
+def _spoken_numbers(words, position):
+    # Yields (value, end) for the spoken numbers below 1000 at position.
+    def below_hundred(position):
+        if position >= len(words):
+            return
+        word = words[position].lower()
+        if word in _NUMBER_UNITS:
+            yield _NUMBER_UNITS[word], position + 1
+        elif word in _NUMBER_TENS:
+            tens = _NUMBER_TENS[word]
+            if position + 1 < len(words):
+                unit = _NUMBER_UNITS.get(words[position + 1].lower())
+                if unit is not None and 0 < unit < 10:
+                    yield tens + unit, position + 2
+            yield tens, position + 1
+
+    for value, end in below_hundred(position):
+        if value < 10 and end < len(words) and words[end].lower() == 'hundred':
+            for rest, final in below_hundred(end + 1):
+                yield value * 100 + rest, final
+            yield value * 100, end + 1
+        yield value, end
+
+
+class Integer(ElementBase):
+    def __init__(self, name=None, min=None, max=None, default=None):
+        ElementBase.__init__(self, name, default)
+        self.min = min
+        self.max = max
+
+    def decode(self, words, position):
+        for value, end in _spoken_numbers(words, position):
+            if self.min <= value < self.max:
+                node = Node(self, words[position:end])
+                node.integer = value
+                yield node, end
+
+    def value(self, node):
+        return node.integer
+
+
+class IntegerRef(Integer):
+    def __init__(self, name, min, max, default=None):
+        Integer.__init__(self, name, min, max, default)
+
+
+class Compound(Alternative):
+    def __init__(self, spec, extras=None, name=None, value=None, default=None):
+        self.spec = spec
+        self._value = value
+        extras = dict((element.name, element) for element in (extras or ()))
+        Alternative.__init__(self, [_SpecParser(spec, extras).parse()],
+                             name=name, default=default)
+
+    def value(self, node):
+        if self._value is not None:
+            return self._value
+        return node.children[0].value()
+
+
+class _SpecParser(object):
+    _token = re.compile(r'<[^>]+>|[\[\]\(\)\|]|[^\s\[\]\(\)\|<>]+')
+
+    def __init__(self, spec, extras):
+        self.spec = spec
+        self.extras = extras
+        self.tokens = self._token.findall(spec)
+        self.index = 0
+
+    def parse(self):
+        element = self._alternatives()
+        if self.index != len(self.tokens):
+            raise GrammarError('Unable to parse spec %r' % self.spec)
+        return element
+
+    def _peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return None
+
+    def _alternatives(self):
+        choices = [self._sequence()]
+        while self._peek() == '|':
+            self.index += 1
+            choices.append(self._sequence())
+        return choices[0] if len(choices) == 1 else Alternative(choices)
+
+    def _sequence(self):
+        items = []
+        literal = []
+        while self._peek() not in (None, '|', ']', ')'):
+            token = self.tokens[self.index]
+            self.index += 1
+            if token not in ('[', '(') and not token.startswith('<'):
+                literal.append(token)
+                continue
+            if literal:
+                items.append(Literal(' '.join(literal)))
+                literal = []
+            if token.startswith('<'):
+                name = token[1:-1]
+                if name not in self.extras:
+                    raise GrammarError('Unknown extra %r in spec %r' % (name, self.spec))
+                items.append(self.extras[name])
+            else:
+                closing = ']' if token == '[' else ')'
+                element = self._alternatives()
+                if self._peek() != closing:
+                    raise GrammarError('Unbalanced %r in spec %r' % (token, self.spec))
+                self.index += 1
+                items.append(Optional(element) if token == '[' else element)
+        if literal:
+            items.append(Literal(' '.join(literal)))
+        if not items:
+            raise GrammarError('Empty alternative in spec %r' % self.spec)
+        return items[0] if len(items) == 1 else Sequence(items)
+
+
+#---------------------------------------------------------------------------
+# Lists
+
+
+class ListBase(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class List(ListBase, list):
+    def __init__(self, name, *args, **kwargs):
+        ListBase.__init__(self, name)
+        list.__init__(self, *args, **kwargs)
+
+
+class DictList(ListBase, dict):
+    def __init__(self, name, *args, **kwargs):
+        ListBase.__init__(self, name)
+        dict.__init__(self, *args, **kwargs)
+
+
+#---------------------------------------------------------------------------
+# Rules
+
+
+class Rule(object):
+    _default_exported = True
+
+    def __init__(self, name=None, element=None, context=None, imported=False,
+                 exported=None):
+        self.name = name or self.__class__.__name__
+        self.element = element
+        self.context = context
+        self.exported = (exported if exported is not None
+                         else getattr(self, 'exported', self._default_exported))
+        self.grammar = None
+        self.enabled = True
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @property
+    def active(self):
+        return (self.enabled and self.grammar is not None and
+                self.grammar.loaded and self.grammar._in_context)
+
+    def decode(self, words, position):
+        for node, end in self.element.decode(words, position):
+            yield Node(self, words[position:end], [node]), end
+
+    def value(self, node):
+        return node.children[0].value()
+
+    def process_begin(self, executable, title, handle):
+        pass
+
+    def process_recognition(self, node):
+        pass
+
+    def _extras_values(self, node, extras, defaults):
+        data = {'_grammar': self.grammar, '_rule': self, '_node': node}
+        data.update(defaults)
+        for name, element in extras.iteritems():
+            extra_node = node.get_child_by_name(name, shallow=True)
+            if extra_node is not None:
+                data[name] = extra_node.value()
+            elif element.has_default():
+                data[name] = element.default
+        return data
+
+
+class CompoundRule(Rule):
+    spec = None
+    extras = ()
+    defaults = {}
+
+    def __init__(self, name=None, spec=None, extras=None, defaults=None,
+                 exported=None, context=None):
+        self.spec = spec if spec is not None else self.spec
+        extras = extras if extras is not None else self.extras
+        self._extras = dict((element.name, element) for element in extras)
+        self._defaults = dict(defaults if defaults is not None else self.defaults)
+        Rule.__init__(self, name, Compound(self.spec, extras), context,
+                      exported=exported)
+
+    def process_recognition(self, node):
+        extras = self._extras_values(node, self._extras, self._defaults)
+        self._process_recognition(node, extras)
+
+    def _process_recognition(self, node, extras):
+        pass
+
+
+class MappingRule(Rule):
+    mapping = {}
+    extras = ()
+    defaults = {}
+
+    def __init__(self, name=None, mapping=None, extras=None, defaults=None,
+                 exported=None, context=None):
+        self._mapping = mapping if mapping is not None else self.mapping
+        extras = extras if extras is not None else self.extras
+        self._extras = dict((element.name, element) for element in extras)
+        self._defaults = dict(defaults if defaults is not None else self.defaults)
+        element = Alternative([Compound(spec, extras, value=value)
+                               for (spec, value) in sorted(self._mapping.iteritems())])
+        Rule.__init__(self, name, element, context, exported=exported)
+
+    def value(self, node):
+        node = node.children[0]
+        value = node.value()
+        if hasattr(value, 'copy_bind'):
+            extras = self._extras_values(node, self._extras, self._defaults)
+            value = value.copy_bind(extras)
+        return value
+
+    def process_recognition(self, node):
+        item = node.children[0]
+        value = item.value()
+        extras = self._extras_values(item, self._extras, self._defaults)
+        self._process_recognition(value, extras)
+
+    def _process_recognition(self, value, extras):
+        if isinstance(value, ActionBase):
+            value.execute(extras)
+
+
+#---------------------------------------------------------------------------
+# Contexts
+
+
+class Context(object):
+    def matches(self, executable, title, handle):
+        return True
+
+    def __and__(self, other):
+        return LogicAndContext(self, other)
+
+    def __or__(self, other):
+        return LogicOrContext(self, other)
+
+    def __invert__(self):
+        return LogicNotContext(self)
+
+
+class LogicAndContext(Context):
+    def __init__(self, *children):
+        self._children = children
+
+    def matches(self, executable, title, handle):
+        return all(c.matches(executable, title, handle) for c in self._children)
+
+
+class LogicOrContext(Context):
+    def __init__(self, *children):
+        self._children = children
+
+    def matches(self, executable, title, handle):
+        return any(c.matches(executable, title, handle) for c in self._children)
+
+
+class LogicNotContext(Context):
+    def __init__(self, child):
+        self._child = child
+
+    def matches(self, executable, title, handle):
+        return not self._child.matches(executable, title, handle)
+
+
+class AppContext(Context):
+    def __init__(self, executable=None, title=None, exclude=False):
+        self._executable = executable.lower() if executable else None
+        self._title = title.lower() if title else None
+        self._exclude = exclude
+
+    def matches(self, executable, title, handle):
+        found = True
+        if self._executable is not None:
+            found = found and self._executable in (executable or '').lower()
+        if self._title is not None:
+            found = found and self._title in (title or '').lower()
+        return found != self._exclude
+
+
+#---------------------------------------------------------------------------
+# Actions
+
+
+class ActionBase(object):
+    def __init__(self):
+        self._bound_data = None
+
+    def copy_bind(self, data):
+        action = copy.copy(self)
+        action._bound_data = data
+        return action
+
+    def execute(self, data=None):
+        if self._bound_data is not None:
+            data = self._bound_data
+        self._execute(data)
+
+    def _execute(self, data):
+        pass
+
+    def __add__(self, other):
+        return ActionSeries(self, other)
+
+    def __mul__(self, factor):
+        return ActionRepetition(self, factor)
+
+
+class ActionSeries(ActionBase):
+    def __init__(self, *actions):
+        ActionBase.__init__(self)
+        self._actions = []
+        for action in actions:
+            if isinstance(action, ActionSeries):
+                self._actions.extend(action._actions)
+            else:
+                self._actions.append(action)
+
+    def _execute(self, data):
+        for action in self._actions:
+            action.execute(data)
+
+
+class ActionRepetition(ActionBase):
+    def __init__(self, action, factor):
+        ActionBase.__init__(self)
+        self._action = action
+        self._factor = factor
+
+    def _execute(self, data):
+        for i in range(int(self._factor)):
+            self._action.execute(data)
+
+
+class DynStrActionBase(ActionBase):
+    def __init__(self, spec=None, static=False):
+        ActionBase.__init__(self)
+        self._spec = spec
+        self._static = static or '%' not in (spec or '')
+
+    def _execute(self, data):
+        spec = self._spec
+        if not self._static:
+            spec = spec % (data or {})
+        self._execute_spec(spec)
+
+    def _execute_spec(self, spec):
+        pass
+
+
+class Function(ActionBase):
+    def __init__(self, function, **defaults):
+        ActionBase.__init__(self)
+        self._function = function
+        self._defaults = defaults
+
+    def _execute(self, data):
+        arguments = dict(self._defaults)
+        arguments.update(data or {})
+        self._function(**arguments)
+
+
+#---------------------------------------------------------------------------
+# Grammars and the engine
+
+
+class Grammar(object):
+    def __init__(self, name, description=None, context=None, engine=None):
+        self.name = name
+        self.description = description
+        self.context = context
+        self.loaded = False
+        self._in_context = False
+        self._rules = []
+        self._engine = engine or get_engine()
+
+    @property
+    def rules(self):
+        return list(self._rules)
+
+    def add_rule(self, rule):
+        if self.loaded:
+            raise GrammarError('Cannot add rule to grammar %r while loaded' % self.name)
+        rule.grammar = self
+        self._rules.append(rule)
+
+    def remove_rule(self, rule):
+        if self.loaded:
+            raise GrammarError('Cannot remove rule from grammar %r while loaded' % self.name)
+        self._rules.remove(rule)
+        rule.grammar = None
+
+    def load(self):
+        if not self.loaded:
+            self._engine.load_grammar(self)
+            self.loaded = True
+
+    def unload(self):
+        if self.loaded:
+            self._engine.unload_grammar(self)
+            self.loaded = False
+            self._in_context = False
+
+    def process_begin(self, executable, title, handle):
+        if self.context is None or self.context.matches(executable, title, handle):
+            self._in_context = True
+            self._process_begin(executable, title, handle)
+            for rule in self._rules:
+                rule.process_begin(executable, title, handle)
+        else:
+            self._in_context = False
+
+    def _process_begin(self, executable, title, handle):
+        pass
+
+
+class Recognition(object):
+    def __init__(self, words):
+        self.words = words
+        self.grammar = None
+        self.rule = None
+        self.node = None
+        self.timings = {}
+
+
+class Engine(object):
+    name = 'replay'
+
+    def __init__(self):
+        self.grammars = []
+        self._timers = []
+
+    def load_grammar(self, grammar):
+        self.grammars.append(grammar)
+
+    def unload_grammar(self, grammar):
+        self.grammars.remove(grammar)
+
+    def create_timer(self, function, interval):
+        timer = Timer(function, interval, engine=self)
+        return timer
+
+    def run_timers(self):
+        for timer in list(self._timers):
+            timer.call()
+
+    def mimic(self, words, executable='', title='', handle=0):
+        '''Recognize words as the engine would, then process the recognition.
+           Returns a Recognition, with rule None if nothing matched.'''
+        if isinstance(words, basestring):
+            words = words.split()
+        recognition = Recognition(list(words))
+
+        for grammar in list(self.grammars):
+            grammar.process_begin(executable, title, handle)
+
+        start = time.time()
+        for grammar in list(self.grammars):
+            for rule in grammar.rules:
+                if not (rule.exported and rule.active):
+                    continue
+                if rule.context is not None and not rule.context.matches(
+                        executable, title, handle):
+                    continue
+                for node, end in rule.decode(recognition.words, 0):
+                    if end == len(recognition.words):
+                        recognition.grammar = grammar
+                        recognition.rule = rule
+                        recognition.node = node
+                        break
+                if recognition.rule is not None:
+                    break
+            if recognition.rule is not None:
+                break
+        recognition.timings['parse'] = time.time() - start
+
+        if recognition.rule is None:
+            return recognition
+
+        start = time.time()
+        recognition.rule.value(recognition.node)
+        recognition.timings['value'] = time.time() - start
+
+        start = time.time()
+        recognition.rule.process_recognition(recognition.node)
+        recognition.timings['process'] = time.time() - start
+        return recognition
+
+
+class Timer(object):
+    def __init__(self, function, interval, engine=None):
+        self.function = function
+        self.interval = interval
+        self._engine = engine or get_engine()
+        self.start()
+
+    def start(self):
+        if self not in self._engine._timers:
+            self._engine._timers.append(self)
+
+    def stop(self):
+        if self in self._engine._timers:
+            self._engine._timers.remove(self)
+
+    def call(self):
+        self.function()
+
+
+_engine = Engine()
+
+
+def get_engine():
+    return _engine
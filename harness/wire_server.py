@@ -0,0 +1,22 @@
+# A stand-in for an Aenea server that accepts batches in the packed encoding
+# of aenea_grammars.wire, decoding them and replaying the commands as the
+# recording server would. It also totals how big the batches were.
+
+import json
+
+import aenea.communications
+
+import aenea_grammars.wire
+
+
+class PackingServer(aenea.communications.RecordingServer):
+    def reset(self):
+        aenea.communications.RecordingServer.reset(self)
+        self.packed_bytes = 0
+        self.json_bytes = 0
+
+    def _rpc_packed_actions(self, packed):
+        commands = aenea_grammars.wire.decode(packed)
+        self.packed_bytes += len(packed)
+        self.json_bytes += len(json.dumps(commands))
+        self._rpc_multiple_actions(commands)